@@ -1,13 +1,17 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
 from trytond.pool import Pool
+from . import ir
 from . import product
 from . import production
+from . import reporting
 
 
 def register():
     Pool.register(
         production.Process,
+        production.ProcessOutputProduct,
+        production.ProcessCost,
         production.Step,
         production.BOMInput,
         production.BOMOutput,
@@ -15,6 +19,16 @@ def register():
         production.Route,
         production.BOM,
         production.Production,
+        production.StepSchedule,
         product.ProductBom,
+        product.ProductCostPrice,
+        product.Product,
         production.StockMove,
+        reporting.StepConsumption,
+        reporting.StepConsumptionContext,
+        production.ApplyProcessStart,
+        ir.Cron,
         module='production_process', type_='model')
+    Pool.register(
+        production.ApplyProcess,
+        module='production_process', type_='wizard')
@@ -0,0 +1,115 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import logging
+import time
+from collections import defaultdict
+from functools import wraps
+from weakref import WeakKeyDictionary
+
+from trytond.config import config
+from trytond.transaction import Transaction
+
+__all__ = ['instrumented', 'get_statistics']
+
+logger = logging.getLogger(__name__)
+
+# Enabled for all the requests with:
+#
+#   [production_process]
+#   instrumentation = True
+#
+# or for a single request with the production_process_instrumentation context
+ENABLED = config.getboolean(
+    'production_process', 'instrumentation', default=False)
+
+_statistics = WeakKeyDictionary()
+
+
+class _Cursor:
+    "Cursor wrapper that counts the executed queries"
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter[0] += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _Connection:
+    "Connection wrapper that returns counting cursors"
+
+    def __init__(self, connection, counter):
+        self._connection = connection
+        self._counter = counter
+
+    def cursor(self, *args, **kwargs):
+        return _Cursor(self._connection.cursor(*args, **kwargs), self._counter)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def _enabled(transaction):
+    return ENABLED or transaction.context.get(
+        'production_process_instrumentation')
+
+
+def _log(transaction):
+    statistics = _statistics.pop(transaction, None)
+    if not statistics:
+        return
+    for name, (calls, queries, elapsed) in sorted(
+            statistics.items(), key=lambda i: i[1][2], reverse=True):
+        logger.info('%s: %s calls, %s queries, %.3fs',
+            name, calls, queries, elapsed)
+
+
+def get_statistics():
+    '''
+    Return the statistics of the current transaction as a dictionary mapping
+    the method names to their calls, queries and elapsed time
+
+    Queries and time of nested instrumented methods are included in their
+    caller.
+    '''
+    return {k: tuple(v)
+        for k, v in _statistics.get(Transaction(), {}).items()}
+
+
+def instrumented(func):
+    '''
+    Record the calls, SQL queries and elapsed time of func per transaction
+    '''
+    name = func.__qualname__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        transaction = Transaction()
+        if not _enabled(transaction):
+            return func(*args, **kwargs)
+
+        if transaction not in _statistics:
+            _statistics[transaction] = defaultdict(lambda: [0, 0, 0.])
+            transaction.atexit(_log, transaction)
+        counter = [0]
+        connection = transaction.connection
+        transaction.connection = _Connection(connection, counter)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            transaction.connection = connection
+            statistic = _statistics[transaction][name]
+            statistic[0] += 1
+            statistic[1] += counter[0]
+            statistic[2] += elapsed
+    return wrapper
@@ -0,0 +1,20 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from trytond.pool import PoolMeta
+
+__all__ = ['Cron']
+
+
+class Cron(metaclass=PoolMeta):
+    __name__ = 'ir.cron'
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.method.selection.extend([
+                ('production|schedule_steps', "Schedule Production Steps"),
+                ('production.process|update_costs',
+                    "Update Production Process Costs"),
+                ('production.process|check_consistency',
+                    "Check Production Process Consistency"),
+                ])
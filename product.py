@@ -1,10 +1,19 @@
 #The COPYRIGHT file at the top level of this repository contains the full
 #copyright notices and license terms.
-from trytond.model import fields
+from collections import defaultdict
+
+from sql import Null
+from sql.conditionals import Case
+
+from trytond.model import Index, fields
 from trytond.pyson import Eval, Get, If, Bool
 from trytond.pool import Pool, PoolMeta
+from trytond.tools import grouped_slice, reduce_ids
+from trytond.transaction import Transaction
 
-__all__ = ['ProductBom']
+from .instrumentation import instrumented
+
+__all__ = ['ProductBom', 'ProductCostPrice', 'Product']
 
 
 class ProductBom(metaclass=PoolMeta):
@@ -30,21 +39,143 @@ class ProductBom(metaclass=PoolMeta):
                     'readonly': Bool(Eval('process', 0)),
                     })
             cls.route.depends.add('process')
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t, (t.process, Index.Equality()),
+                where=t.process != Null))
+
+    @classmethod
+    def get_default_processes(cls, product_ids):
+        '''
+        Return a dictionary mapping the product ids to the process of their
+        first BOM
+        '''
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {}
+        for sub_ids in grouped_slice(product_ids):
+            cursor.execute(*table.select(table.product, table.process,
+                    where=reduce_ids(table.product, sub_ids),
+                    order_by=[table.product,
+                        Case((table.sequence == Null, 0), else_=1),
+                        table.sequence, table.id]))
+            for product_id, process_id in cursor:
+                result.setdefault(product_id, process_id)
+        return result
 
     @fields.depends('process', 'bom', 'route')
+    @instrumented
     def on_change_process(self):
+        Process = Pool().get('production.process')
         if self.process:
-            self.bom = self.process.bom
-            self.route = self.process.route
+            self.bom, self.route = Process.get_bom_route(
+                [self.process.id])[self.process.id]
 
     @classmethod
+    @instrumented
     def create(cls, vlist):
         pool = Pool()
         Process = pool.get('production.process')
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if values.get('process'):
-                process = Process(values['process'])
-                values['bom'] = process.bom.id
-                values['route'] = process.route.id
+        process_ids = {v['process'] for v in vlist if v.get('process')}
+        if process_ids:
+            bom_routes = Process.get_bom_route(process_ids)
+            for values in vlist:
+                if values.get('process'):
+                    values['bom'], values['route'] = bom_routes[
+                        values['process']]
         return super(ProductBom, cls).create(vlist)
+
+
+class ProductCostPrice(metaclass=PoolMeta):
+    __name__ = 'product.cost_price'
+
+    @classmethod
+    def _update_process_costs(cls, keys):
+        '''
+        Recompute the costs of the processes consuming the products only for
+        the company of their cost price
+
+        keys is an iterable of (company id, product id).
+        '''
+        pool = Pool()
+        Process = pool.get('production.process')
+        BOMInput = pool.get('production.bom.input')
+        company2products = defaultdict(set)
+        for company, product in keys:
+            if company and product:
+                company2products[company].add(product)
+        for company, product_ids in company2products.items():
+            bom_ids = set()
+            for sub_ids in grouped_slice(product_ids):
+                bom_ids.update(i['bom'] for i in BOMInput.search_read([
+                            ('product', 'in', list(sub_ids)),
+                            ('step', '!=', None),
+                            ], fields_names=['bom']))
+            Process._update_related_costs('bom', bom_ids, [company])
+
+    @staticmethod
+    def _process_cost_key(cost_price, values=None):
+        "Return the (company id, product id) of cost_price updated by values"
+        values = values or {}
+        company = cost_price.company.id if cost_price.company else None
+        product = cost_price.product.id if cost_price.product else None
+        return (
+            values.get('company', company), values.get('product', product))
+
+    @classmethod
+    def create(cls, vlist):
+        cost_prices = super(ProductCostPrice, cls).create(vlist)
+        cls._update_process_costs(
+            {cls._process_cost_key(c) for c in cost_prices})
+        return cost_prices
+
+    @classmethod
+    def write(cls, *args):
+        keys = set()
+        actions = iter(args)
+        for cost_prices, values in zip(actions, actions):
+            for cost_price in cost_prices:
+                keys.add(cls._process_cost_key(cost_price))
+                keys.add(cls._process_cost_key(cost_price, values))
+        super(ProductCostPrice, cls).write(*args)
+        cls._update_process_costs(keys)
+
+    @classmethod
+    def delete(cls, cost_prices):
+        keys = {cls._process_cost_key(c) for c in cost_prices}
+        super(ProductCostPrice, cls).delete(cost_prices)
+        cls._update_process_costs(keys)
+
+
+class Product(metaclass=PoolMeta):
+    __name__ = 'product.product'
+
+    @classmethod
+    def search(cls, domain, *args, **kwargs):
+        Production = Pool().get('production')
+        # Restrict only the search of the products to supply of a partition so
+        # the stock is computed for the partition and the other searches like
+        # the domain validation of the moves are not changed
+        partition = Transaction().context.get('_supply_partition')
+        if (partition is not None
+                and domain == Production._supply_products_domain()):
+            domain = [domain, ('id', 'in', partition)]
+        return super(Product, cls).search(domain, *args, **kwargs)
+
+    @classmethod
+    def supply_production_requests(cls, products, warehouses=None):
+        '''
+        Generate the production requests of the products only, keeping the
+        existing requests
+
+        warehouses is the list of warehouse ids to supply, all if None.
+        '''
+        pool = Pool()
+        Production = pool.get('production')
+        Location = pool.get('stock.location')
+        if warehouses is not None:
+            warehouses = Location.browse(warehouses)
+        return Production.generate_requests(
+            clean=False, warehouses=warehouses, products=products)
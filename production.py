@@ -1,14 +1,69 @@
 
-from trytond.model import ModelSQL, ModelView, DeactivableMixin, fields
+import datetime
+import json
+import logging
+from collections import defaultdict, deque
+from decimal import Decimal
+from itertools import islice
+
+from sql import Literal, Null, Union, Window, With
+from sql.aggregate import Max
+from sql.conditionals import Coalesce
+from sql.functions import RowNumber
+
+from trytond import backend
+from trytond.cache import Cache
+from trytond.config import config
+from trytond.model import (
+    ModelSQL, ModelView, DeactivableMixin, Index, Unique, fields)
 from trytond.pool import Pool, PoolMeta
 from trytond.pyson import Bool, Eval
+from trytond.rpc import RPC
 from trytond.transaction import Transaction
+from trytond.wizard import Button, StateTransition, StateView, Wizard
 from trytond.i18n import gettext
+from trytond.modules.product import price_digits, round_price
 from trytond.exceptions import UserError
+from trytond.tools import grouped_slice, reduce_ids
+
+from .instrumentation import instrumented
+from .scheduler import schedule
+
+
+__all__ = ['Process', 'ProcessOutputProduct', 'ProcessCost', 'Step',
+    'BOMInput', 'BOMOutput', 'Operation', 'BOM', 'Route', 'Production',
+    'StepSchedule', 'StockMove', 'ApplyProcessStart', 'ApplyProcess']
+
+logger = logging.getLogger(__name__)
 
+# Number of partitions of the products for the parallel generation of the
+# production requests, enabled with:
+#
+#   [production_process]
+#   supply_partitions = 4
+#
+# or with the supply_partitions context
+SUPPLY_PARTITIONS = config.getint(
+    'production_process', 'supply_partitions', default=0)
 
-__all__ = ['Process', 'Step', 'BOMInput', 'BOMOutput', 'Operation', 'BOM',
-    'Route', 'Production', 'StockMove']
+
+def _old2new(records, new_records):
+    '''
+    Return the list of mappings from the ids of records to the ids of their
+    copies matched by position
+
+    A record copied more than once is mapped in a new mapping for each of its
+    copies.
+    '''
+    mappings = []
+    occurrences = defaultdict(int)
+    for old, new in zip(records, new_records):
+        occurrence = occurrences[old.id]
+        if occurrence == len(mappings):
+            mappings.append({})
+        mappings[occurrence][old.id] = new.id
+        occurrences[old.id] += 1
+    return mappings
 
 
 class Process(DeactivableMixin, ModelSQL, ModelView):
@@ -28,21 +83,72 @@ class Process(DeactivableMixin, ModelSQL, ModelView):
             'readonly': Bool(Eval('steps', [0])),
             })
     inputs = fields.Function(fields.One2Many('production.bom.input', None,
-            'Inputs'), 'get_bom_field', setter='_set_bom_field')
+            'Inputs'), 'get_lines', setter='_set_bom_field')
     outputs = fields.Function(fields.One2Many('production.bom.output', None,
-            'Outputs'), 'get_bom_field', setter='_set_bom_field')
-    output_products = fields.Function(fields.Many2Many('production.bom.output',
-            'bom', 'product', 'Outputs'), 'get_bom_field',
-        searcher='search_bom_field')
+            'Outputs'), 'get_lines', setter='_set_bom_field')
+    output_products = fields.Many2Many('production.process-product.product',
+        'process', 'product', 'Outputs', readonly=True)
     operations = fields.Function(fields.One2Many('production.route.operation',
-            None, 'Operations'), 'get_operations', setter='_set_operations')
+            None, 'Operations'), 'get_lines', setter='_set_operations')
     uom = fields.Many2One('product.uom', 'UOM', required=True)
+    cost = fields.Function(fields.Numeric('Cost', digits=price_digits,
+            help='The cost of the inputs and operations of all the steps.'),
+        'get_cost')
+    _plan_cache = Cache('production.process.plan', context=False)
+    _bom_route_cache = Cache('production.process.bom_route', context=False)
+
+    @classmethod
+    def __setup__(cls):
+        super(Process, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t, (t.bom, Index.Equality())),
+                Index(t, (t.route, Index.Equality())),
+                })
+        cls.__rpc__.update({
+                'preview': RPC(instantiate=0),
+                })
+
+    @classmethod
+    def _get_lines_models(cls):
+        '''
+        Return a dictionary mapping the line fields to their model and the
+        process field they belong to
+        '''
+        return {
+            'inputs': ('production.bom.input', 'bom'),
+            'outputs': ('production.bom.output', 'bom'),
+            'operations': ('production.route.operation', 'route'),
+            }
+
+    @classmethod
+    @instrumented
+    def get_lines(cls, processes, names):
+        pool = Pool()
+        models = cls._get_lines_models()
+        bom_routes = cls.get_bom_route([p.id for p in processes])
+        parents = {
+            'bom': defaultdict(list),
+            'route': defaultdict(list),
+            }
+        for process_id, (bom, route) in bom_routes.items():
+            parents['bom'][bom].append(process_id)
+            parents['route'][route].append(process_id)
 
-    def get_bom_field(self, name):
-        res = []
-        if self.bom:
-            res += [x.id for x in getattr(self.bom, name)]
-        return res
+        result = {}
+        for name in names:
+            model, field = models[name]
+            Line = pool.get(model)
+            result[name] = values = {p.id: [] for p in processes}
+            parent2processes = parents[field]
+            order = cls._lines_order() if field == 'bom' else None
+            for sub_ids in grouped_slice(list(parent2processes)):
+                for line in Line.search_read([
+                            (field, 'in', list(sub_ids)),
+                            ], order=order, fields_names=[field]):
+                    for process_id in parent2processes[line[field]]:
+                        values[process_id].append(line['id'])
+        return result
 
     @classmethod
     def _set_bom_field(cls, processes, name, value):
@@ -54,32 +160,714 @@ class Process(DeactivableMixin, ModelSQL, ModelView):
         # Prevent NotImplementedError for One2Many
         pass
 
-    def get_operations(self, name):
-        res = []
-        if self.route:
-            res += [x.id for x in self.route.operations]
-        return res
+    @classmethod
+    def get_bom_route(cls, process_ids):
+        '''
+        Return a dictionary mapping each process id to its (bom, route) ids
+        '''
+        return {p: (bom, route)
+            for p, (bom, route, _) in cls.get_bom_route_uom(
+                process_ids).items()}
+
+    @classmethod
+    def get_bom_route_uom(cls, process_ids):
+        '''
+        Return a dictionary mapping each process id to its (bom, route, uom)
+        ids
+
+        The ids are kept in cache until a process is modified so the processes
+        are not read again when they are navigated many times.
+        '''
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {}
+        missing = []
+        for process_id in process_ids:
+            value = cls._bom_route_cache.get(process_id)
+            if value is not None:
+                result[process_id] = value
+            else:
+                missing.append(process_id)
+        for sub_ids in grouped_slice(missing):
+            cursor.execute(*table.select(
+                    table.id, table.bom, table.route, table.uom,
+                    where=reduce_ids(table.id, sub_ids)))
+            for process_id, bom, route, uom in cursor:
+                result[process_id] = cls._bom_route_cache.set(
+                    process_id, (bom, route, uom))
+        return result
+
+    @instrumented
+    def get_plan(self):
+        '''
+        Return the plan of the process: a read-only snapshot of its BOM,
+        route, steps, inputs, outputs and operations that is kept in cache
+        until any of them is modified
+        '''
+        plan = self._plan_cache.get(self.id)
+        if plan is None:
+            plan = self._plan_cache.set(self.id, self._compile_plan())
+        return plan
+
+    def _compile_plan(self):
+        pool = Pool()
+        Step = pool.get('production.process.step')
+        BOMInput = pool.get('production.bom.input')
+        BOMOutput = pool.get('production.bom.output')
+        Operation = pool.get('production.route.operation')
+
+        line_fields = ['step', 'product', 'phantom_bom', 'quantity', 'unit']
+        bom, route, uom = self.get_bom_route_uom([self.id])[self.id]
+        plan = {
+            'bom': bom,
+            'route': route,
+            'uom': uom,
+            'steps': Step.search_read([
+                    ('process', '=', self.id),
+                    ], fields_names=['name', 'sequence']),
+            'inputs': BOMInput.search_read([
+                    ('bom', '=', bom),
+                    ], order=self._lines_order(), fields_names=line_fields),
+            'outputs': BOMOutput.search_read([
+                    ('bom', '=', bom),
+                    ], order=self._lines_order(), fields_names=line_fields),
+            'operations': Operation.search_read([
+                    ('route', '=', route),
+                    ], fields_names=['step', 'work_center',
+                    'work_center_category', 'time', 'quantity',
+                    'quantity_uom', 'calculation']),
+            }
+        plan['factors'] = {type: self._compile_factors(plan[type])
+            for type in ['inputs', 'outputs']}
+        plan['tasks'] = self._compile_tasks(plan)
+        plan['preview'] = self._compile_preview(plan)
+        return plan
+
+    @staticmethod
+    def _lines_order():
+        "Return the order of the BOM lines in the process"
+        return [
+            ('step.sequence', 'ASC'),
+            ('step_sequence', 'ASC'),
+            ('id', 'ASC'),
+            ]
+
+    @staticmethod
+    def _compile_factors(lines):
+        '''
+        Return the factor table of lines: for each product, the steps where
+        it is found and its total quantity per unit
+        '''
+        factors = {}
+        for line in lines:
+            if not line['product']:
+                continue
+            factor = factors.setdefault(line['product'], {
+                    'steps': [],
+                    'quantities': defaultdict(float),
+                    })
+            if line['step'] and line['step'] not in factor['steps']:
+                factor['steps'].append(line['step'])
+            factor['quantities'][line['unit']] += line['quantity'] or 0
+        return factors
+
+    @staticmethod
+    def _compile_tasks(plan):
+        '''
+        Return the operations of the steps in order with their resource and
+        time in hours
+        '''
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        ModelData = pool.get('ir.model.data')
+        Category = pool.get('production.work_center.category')
+
+        hour = Uom(ModelData.get_id('product', 'uom_hour'))
+        categories = {c.id: c for c in Category.browse(
+                {o['work_center_category'] for o in plan['operations']
+                    if o['work_center_category']})}
+        step2operations = defaultdict(list)
+        for operation in plan['operations']:
+            step2operations[operation['step']].append(operation)
+
+        tasks = []
+        for step in plan['steps']:
+            operations = step2operations.get(step['id'])
+            if not operations:
+                tasks.append({
+                        'step': step['id'],
+                        'operation': None,
+                        'resource': None,
+                        'hours': 0,
+                        'calculation': 'fixed',
+                        })
+                continue
+            for operation in operations:
+                if operation['work_center']:
+                    resource = (
+                        'production.work_center', operation['work_center'])
+                elif operation['work_center_category']:
+                    resource = ('production.work_center.category',
+                        operation['work_center_category'])
+                else:
+                    resource = None
+                hours = operation['time'] or 0
+                category = categories.get(operation['work_center_category'])
+                if (category and category.uom
+                        and category.uom.category == hour.category):
+                    hours = Uom.compute_qty(
+                        category.uom, hours, hour, round=False)
+                tasks.append({
+                        'step': step['id'],
+                        'operation': operation['id'],
+                        'resource': resource,
+                        'hours': hours,
+                        'calculation': operation['calculation'],
+                        'quantity': operation['quantity'],
+                        'quantity_uom': operation['quantity_uom'],
+                        })
+        return tasks
+
+    @staticmethod
+    def _compile_preview(plan):
+        '''
+        Return the base of the preview: the steps of the plan with their lines
+        and operations, and the rounding of the units of the lines
+        '''
+        Uom = Pool().get('product.uom')
+        units = {line['unit'] for type in ['inputs', 'outputs']
+            for line in plan[type] if line['unit']}
+        preview = {
+            'roundings': {u.id: u.rounding for u in Uom.browse(units)},
+            'steps': [],
+            }
+        steps = {}
+        for step in plan['steps']:
+            steps[step['id']] = {
+                'id': step['id'],
+                'name': step['name'],
+                'inputs': [],
+                'outputs': [],
+                'operations': [],
+                }
+            preview['steps'].append(steps[step['id']])
+        for type in ['inputs', 'outputs']:
+            for line in plan[type]:
+                if line['step'] in steps:
+                    steps[line['step']][type].append({
+                            'product': line['product'],
+                            'quantity': line['quantity'] or 0,
+                            'unit': line['unit'],
+                            })
+        for task in plan['tasks']:
+            if task['operation']:
+                resource = task['resource']
+                steps[task['step']]['operations'].append({
+                        'operation': task['operation'],
+                        'resource': resource and '%s,%s' % resource,
+                        })
+        return preview
+
+    def preview(self, product, quantity, uom):
+        '''
+        Return the steps of the process with their inputs, outputs and the
+        hours of their operations to produce quantity of the unit uom of
+        product (ids)
+
+        The lines are scaled like explode_bom does from the output of product
+        so the by-products do not change the preview.
+        The preview is scaled from the plan so the process is not loaded again
+        while its plan is in cache.
+        Return None if product is not an output of the process.
+        '''
+        pool = Pool()
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+        plan = self.get_plan()
+        base = plan['preview']
+        uom = Uom(uom)
+        factor = self.compute_factor(Product(product), quantity or 0, uom)
+        if factor is None:
+            return
+
+        hours = {}
+        for task, (_, _, duration) in zip(
+                plan['tasks'], self.compute_tasks(quantity, uom)):
+            if task['operation']:
+                hours[task['operation']] = duration.total_seconds() / 3600
+
+        def scale(line):
+            unit = Uom(line['unit'], rounding=base['roundings'][line['unit']])
+            return dict(line, quantity=unit.round(line['quantity'] * factor))
+
+        return [dict(step,
+                inputs=[scale(line) for line in step['inputs']],
+                outputs=[scale(line) for line in step['outputs']],
+                operations=[dict(o, hours=hours[o['operation']])
+                    for o in step['operations']])
+            for step in base['steps']]
+
+    def compute_tasks(self, quantity, unit):
+        '''
+        Return the ordered list of (step, resource, duration) to produce
+        quantity of unit with the process
+
+        The time of the standard operations is proportional to the quantity
+        and a step without operation is a task without duration.
+        '''
+        Uom = Pool().get('product.uom')
+        result = []
+        for task in self.get_plan()['tasks']:
+            hours = task['hours']
+            if task['calculation'] == 'standard':
+                task_quantity = quantity or 0
+                task_uom = task['quantity_uom'] and Uom(task['quantity_uom'])
+                if unit and task_uom and unit.category == task_uom.category:
+                    task_quantity = Uom.compute_qty(
+                        unit, task_quantity, task_uom, round=False)
+                if task['quantity']:
+                    hours *= task_quantity / task['quantity']
+            result.append((task['step'], task['resource'],
+                    datetime.timedelta(hours=hours)))
+        return result
+
+    def compute_factor(self, product, quantity, uom, type='outputs'):
+        '''
+        Compute factor for an output product (or input product if type is
+        'inputs')
+
+        The quantities of all the lines with the product are added up.
+        Return None if no line of the BOM has the product.
+        '''
+        Uom = Pool().get('product.uom')
+        assert type in {'inputs', 'outputs'}
+        factor = self.get_plan()['factors'][type].get(product.id)
+        if factor is None:
+            return
+        total = sum(Uom.compute_qty(Uom(unit), line_quantity, uom, round=False)
+            for unit, line_quantity in factor['quantities'].items())
+        if total:
+            return quantity / total
+        return 0
 
     @classmethod
-    def search_bom_field(cls, name, clause):
-        return [tuple(('bom.' + name,)) + tuple(clause[1:])]
+    def get_cost(cls, processes, name):
+        ProcessCost = Pool().get('production.process.cost')
+        return ProcessCost.get_costs('process', processes)
 
-    def compute_factor(self, product, quantity, uom):
+    @classmethod
+    @instrumented
+    def update_costs(cls, processes=None, companies=None):
         '''
-        Compute factor for an output product
+        Recompute the stored costs of the steps and of the processes for the
+        companies (ids)
+
+        All the processes are recomputed if processes is None and for all the
+        companies if companies is None.
         '''
-        # TODO: Support that the same product is set as output of more
-        # than one step
-        for step in self.steps:
-            factor = step.bom.compute_factor(product, quantity, uom)
-            if factor is not None:
-                return factor
+        pool = Pool()
+        Company = pool.get('company.company')
+        ProcessCost = pool.get('production.process.cost')
+        table = ProcessCost.__table__()
+        cursor = Transaction().connection.cursor()
+
+        if companies is None:
+            companies = Company.search([])
+        else:
+            companies = Company.browse(companies)
+        company_where = reduce_ids(table.company, [c.id for c in companies])
+        with Transaction().set_context(active_test=False):
+            if processes is None:
+                processes = cls.search([])
+                cursor.execute(*table.delete(where=company_where))
+            else:
+                processes = cls.search([
+                        ('id', 'in', list({p.id for p in processes})),
+                        ])
+                for sub_ids in grouped_slice([p.id for p in processes]):
+                    cursor.execute(*table.delete(
+                            where=reduce_ids(table.process, sub_ids)
+                            & company_where))
+        to_create = []
+        for company in companies:
+            to_create.extend(cls._compute_costs(processes, company))
+        ProcessCost.create(to_create)
 
     @classmethod
+    def _update_related_costs(cls, field, ids, companies=None):
+        '''
+        Queue the computation of the costs of the processes with the field in
+        ids for the companies (ids), all if None
+
+        The costs are not recomputed inside the transaction of the change so
+        frequent changes like the cost prices of the moves stay cheap.
+        '''
+        if not ids or not Transaction().context.get('_process_costs', True):
+            return
+        with Transaction().set_context(active_test=False):
+            processes = cls.search([(field, 'in', list(ids))])
+        if processes:
+            cls.__queue__.update_costs(processes, companies)
+
+    @classmethod
+    def _compute_costs(cls, processes, company):
+        '''
+        Return the values of production.process.cost of the steps and of the
+        processes for the company
+        '''
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Product = pool.get('product.product')
+        CostPrice = pool.get('product.cost_price')
+        WorkCenter = pool.get('production.work_center')
+        Category = pool.get('production.work_center.category')
+
+        plans = {p.id: p.get_plan() for p in processes}
+        product_ids = {i['product'] for p in plans.values()
+            for i in p['inputs'] if i['product'] and i['step']}
+        products = {p.id: p for p in Product.browse(list(product_ids))}
+        cost_prices = {}
+        for sub_ids in grouped_slice(product_ids):
+            for cost_price in CostPrice.search_read([
+                        ('company', '=', company.id),
+                        ('product', 'in', list(sub_ids)),
+                        ], fields_names=['product', 'cost_price']):
+                cost_prices[cost_price['product']] = cost_price['cost_price']
+        operations = [o for p in plans.values() for o in p['operations']
+            if o['step']]
+        work_centers = {w.id: w for w in WorkCenter.browse(
+                list({o['work_center'] for o in operations
+                        if o['work_center']}))}
+        categories = {c.id: c for c in Category.browse(
+                list({o['work_center_category'] for o in operations
+                        if o['work_center_category']}))}
+
+        result = []
+        for process in processes:
+            plan = plans[process.id]
+            input_costs = defaultdict(Decimal)
+            operation_costs = defaultdict(Decimal)
+            for input_ in plan['inputs']:
+                if not input_['step'] or not input_['product']:
+                    continue
+                product = products[input_['product']]
+                quantity = Uom.compute_qty(Uom(input_['unit']),
+                    input_['quantity'] or 0, product.default_uom, round=False)
+                input_costs[input_['step']] += (Decimal(str(quantity))
+                    * (cost_prices.get(product.id) or 0))
+            for operation in plan['operations']:
+                if not operation['step']:
+                    continue
+                if operation['work_center']:
+                    cost_price = work_centers[
+                        operation['work_center']].cost_price
+                elif operation['work_center_category']:
+                    cost_price = categories[
+                        operation['work_center_category']].cost_price
+                else:
+                    continue
+                time = Decimal(str(operation['time'] or 0))
+                if (operation['calculation'] == 'standard'
+                        and operation['quantity']):
+                    time *= Decimal(str(
+                            cls._run_quantity(plan, operation['quantity_uom'])
+                            / operation['quantity']))
+                operation_costs[operation['step']] += time * (cost_price or 0)
+
+            total = {
+                'input_cost': Decimal(0),
+                'operation_cost': Decimal(0),
+                }
+            for step in plan['steps']:
+                values = {
+                    'company': company.id,
+                    'process': process.id,
+                    'step': step['id'],
+                    'input_cost': round_price(input_costs[step['id']]),
+                    'operation_cost': round_price(operation_costs[step['id']]),
+                    }
+                values['cost'] = (
+                    values['input_cost'] + values['operation_cost'])
+                for name in total:
+                    total[name] += values[name]
+                result.append(values)
+            result.append(dict(total,
+                    company=company.id,
+                    process=process.id,
+                    step=None,
+                    cost=total['input_cost'] + total['operation_cost']))
+        return result
+
+    @staticmethod
+    def _run_quantity(plan, uom_id):
+        '''
+        Return the quantity of the outputs of a run of the plan in the unit,
+        1 if none of them can be converted into it
+        '''
+        Uom = Pool().get('product.uom')
+        if not uom_id:
+            return 1
+        uom = Uom(uom_id)
+        quantity = 0
+        for output in plan['outputs']:
+            unit = Uom(output['unit'])
+            if unit.category == uom.category:
+                quantity += Uom.compute_qty(
+                    unit, output['quantity'] or 0, uom, round=False)
+        return quantity or 1
+
+    def compute_requirements(self, product):
+        '''
+        Return the list of (step, product, unit, quantity) of the inputs
+        consumed to produce one unit of product in its default unit
+        '''
+        factor = self.compute_factor(product, 1, product.default_uom)
+        if not factor:
+            return []
+        return [(i['step'], i['product'], i['unit'], i['quantity'] * factor)
+            for i in self.get_plan()['inputs'] if i['product']]
+
+    @classmethod
+    @instrumented
+    def explode_requirements(cls, demands, warehouse=None, date=None):
+        '''
+        Explode the demands, a list of (product, quantity, unit), through the
+        default processes of the products and of their inputs at all levels
+
+        Return a dictionary with:
+            - products: product id to a dictionary with its gross and net
+              quantities in its default unit, its process and its level
+            - steps: (step id, product id) to a dictionary with the gross and
+              net quantities of the product consumed by the step
+
+        The net quantity is the gross quantity less the stock of the
+        warehouse at the date and only the net quantity is exploded further.
+        '''
+        pool = Pool()
+        Date = pool.get('ir.date')
+        Uom = pool.get('product.uom')
+        Product = pool.get('product.product')
+        ProductBom = pool.get('product.product-production.bom')
+
+        gross = defaultdict(float)
+        for product, quantity, unit in demands:
+            gross[product.id] += Uom.compute_qty(
+                unit, quantity, product.default_uom, round=False)
+
+        # Walk the graph level by level to resolve the processes in batch
+        # and explode each product once
+        products, product2process, requirements = {}, {}, {}
+        processes = {}
+        frontier = set(gross)
+        while frontier:
+            products.update((p.id, p) for p in Product.browse(list(frontier)))
+            product2process.update(
+                ProductBom.get_default_processes(list(frontier)))
+            for product_id in frontier:
+                process_id = product2process.get(product_id)
+                if process_id:
+                    if process_id not in processes:
+                        processes[process_id] = cls(process_id)
+                    requirements[product_id] = processes[
+                        process_id].compute_requirements(products[product_id])
+                else:
+                    requirements[product_id] = []
+            frontier = {r[1] for p in frontier for r in requirements[p]
+                if r[1] not in requirements}
+
+        # Topological sort of the products so their gross quantity is
+        # complete before being exploded
+        children = {p: {r[1] for r in requirements[p]} for p in requirements}
+        indegree = defaultdict(int)
+        for product_ids in children.values():
+            for product_id in product_ids:
+                indegree[product_id] += 1
+        queue = deque(p for p in requirements if not indegree[p])
+        levels = {p: 0 for p in queue}
+        order = []
+        while queue:
+            product_id = queue.popleft()
+            order.append(product_id)
+            for child in children[product_id]:
+                levels[child] = max(
+                    levels.get(child, 0), levels[product_id] + 1)
+                indegree[child] -= 1
+                if not indegree[child]:
+                    queue.append(child)
+        if len(order) < len(requirements):
+            ordered = set(order)
+            raise UserError(gettext(
+                    'production_process.msg_requirements_cycle',
+                    products=', '.join(products[p].rec_name
+                        for p in requirements if p not in ordered)))
+
+        stock = defaultdict(float)
+        if warehouse:
+            with Transaction().set_context(
+                    stock_date_end=date or Date.today()):
+                for sub_ids in grouped_slice(list(requirements)):
+                    quantities = Product.products_by_location(
+                        [warehouse.id], with_childs=True,
+                        grouping_filter=(list(sub_ids),))
+                    for (_, product_id), quantity in quantities.items():
+                        stock[product_id] += quantity
+
+        result = {
+            'products': {},
+            'steps': {},
+            }
+        for product_id in order:
+            net = max(gross[product_id] - max(stock[product_id], 0), 0)
+            result['products'][product_id] = {
+                'gross': gross[product_id],
+                'net': net,
+                'process': product2process.get(product_id),
+                'level': levels[product_id],
+                }
+            for step, child, unit, quantity in requirements[product_id]:
+                quantity = Uom.compute_qty(Uom(unit), quantity * net,
+                    products[child].default_uom, round=False)
+                gross[child] += quantity
+                step_quantities = result['steps'].setdefault((step, child), {
+                        'gross': 0,
+                        'net': 0,
+                        })
+                step_quantities['gross'] += quantity
+        for (step, product_id), quantities in result['steps'].items():
+            product_quantities = result['products'][product_id]
+            if product_quantities['gross']:
+                quantities['net'] = (quantities['gross']
+                    * product_quantities['net'] / product_quantities['gross'])
+        return result
+
+    @classmethod
+    @instrumented
+    def where_used(cls, products):
+        '''
+        Return a dictionary with the ids of the processes, steps and open
+        productions that consume the products directly or through the outputs
+        of the processes that consume them
+
+        The uses are found by a single recursive query over the inputs and the
+        output products of the processes.
+        '''
+        pool = Pool()
+        BOMInput = pool.get('production.bom.input')
+        OutputProduct = pool.get('production.process-product.product')
+        Production = pool.get('production')
+        cursor = Transaction().connection.cursor()
+
+        result = {
+            'processes': set(),
+            'steps': set(),
+            'productions': set(),
+            }
+        if not products:
+            return {k: [] for k in result}
+
+        used = With('process', 'step', recursive=True)
+        input_ = BOMInput.__table__()
+        process = cls.__table__()
+        used.query = input_.join(process,
+            condition=input_.bom == process.bom
+            ).select(process.id, input_.step,
+            where=reduce_ids(input_.product, [p.id for p in products]))
+        output = OutputProduct.__table__()
+        input_ = BOMInput.__table__()
+        process = cls.__table__()
+        used.query |= (used
+            .join(output, condition=output.process == used.process)
+            .join(input_, condition=input_.product == output.product)
+            .join(process, condition=input_.bom == process.bom)
+            .select(process.id, input_.step))
+
+        production = Production.__table__()
+        cursor.execute(*Union(
+                used.select(Literal('processes'), used.process),
+                used.select(Literal('steps'), used.step,
+                    where=used.step != Null),
+                used.join(production,
+                    condition=production.process == used.process
+                    ).select(Literal('productions'), production.id,
+                    where=production.state.in_(
+                        Production._schedule_states())),
+                with_=[used]))
+        for key, id_ in cursor:
+            result[key].add(id_)
+        return {k: sorted(v) for k, v in result.items()}
+
+    @classmethod
+    @instrumented
+    def get_inconsistencies(cls):
+        '''
+        Return the list of (check, model, id) of the records that break the
+        consistency of the process trees
+
+        The checks are:
+            - bom: a line of a step that is not in the BOM of its process
+            - route: an operation of a step that is not in the route of its
+              process
+            - orphan: a step without process
+            - sequence: a line with a step sequence but without step
+
+        All the checks run on the whole database as a single query.
+        '''
+        pool = Pool()
+        Step = pool.get('production.process.step')
+        Operation = pool.get('production.route.operation')
+        cursor = Transaction().connection.cursor()
+
+        queries = []
+        for model in ['production.bom.input', 'production.bom.output']:
+            table = pool.get(model).__table__()
+            step = Step.__table__()
+            process = cls.__table__()
+            queries.append(table
+                .join(step, condition=table.step == step.id)
+                .join(process, condition=step.process == process.id)
+                .select(Literal('bom'), Literal(model), table.id,
+                    where=table.bom != process.bom))
+            queries.append(table.select(
+                    Literal('sequence'), Literal(model), table.id,
+                    where=(table.step == Null)
+                    & (table.step_sequence != Null)))
+        operation = Operation.__table__()
+        step = Step.__table__()
+        process = cls.__table__()
+        queries.append(operation
+            .join(step, condition=operation.step == step.id)
+            .join(process, condition=step.process == process.id)
+            .select(Literal('route'), Literal(Operation.__name__),
+                operation.id,
+                where=operation.route != process.route))
+        step = Step.__table__()
+        queries.append(step.select(
+                Literal('orphan'), Literal(Step.__name__), step.id,
+                where=step.process == Null))
+
+        cursor.execute(*Union(*queries, all_=True))
+        return sorted(cursor)
+
+    @classmethod
+    def check_consistency(cls):
+        '''
+        Log the inconsistencies of the process trees and return them
+
+        Meant to run as a scheduled task.
+        '''
+        inconsistencies = cls.get_inconsistencies()
+        for check, model, id_ in inconsistencies:
+            logger.warning('inconsistent %s: %s,%s', check, model, id_)
+        return inconsistencies
+
+    @classmethod
+    @instrumented
     def create(cls, vlist):
         pool = Pool()
         BOM = pool.get('production.bom')
         Route = pool.get('production.route')
+        OutputProduct = pool.get('production.process-product.product')
 
         vlist = [x.copy() for x in vlist]
         boms_to_create = []
@@ -105,70 +893,501 @@ class Process(DeactivableMixin, ModelSQL, ModelView):
             for values, bom, route in zip(without_boms, boms, routes):
                 values['bom'] = bom.id
                 values['route'] = route.id
-        return super(Process, cls).create(with_boms + without_boms)
+        # Costs are computed once all the steps and lines are created
+        with Transaction().set_context(_process_costs=False):
+            processes = super(Process, cls).create(with_boms + without_boms)
+        OutputProduct.refresh({v['bom'] for v in with_boms + without_boms})
+        cls._update_related_costs('id', [p.id for p in processes])
+        return processes
 
     @classmethod
+    @instrumented
     def copy(cls, processes, default=None):
+        pool = Pool()
+        Step = pool.get('production.process.step')
+
         if default is None:
             default = {}
         else:
             default = default.copy()
         default['bom'] = None
         default['route'] = None
+        default['output_products'] = None
+        default.setdefault('name', lambda data: '%s (*)' % data['name'])
+        # Steps are copied at once for all processes instead of per process
+        copy_steps = 'steps' not in default
+        default['steps'] = None
+        step_default = {k[len('steps.'):]: v for k, v in default.items()
+            if k.startswith('steps.')}
 
-        res = []
-        for process in processes:
-            local_default = default.copy()
-            local_default['name'] = '%s (*)' % process.name
-            res += super(Process, cls).copy([process], default=local_default)
-        return res
+        with Transaction().set_context(_process_costs=False):
+            new_processes = super(Process, cls).copy(
+                processes, default=default)
+            if copy_steps:
+                for old2new in _old2new(processes, new_processes):
+                    steps = Step.search([
+                            ('process', 'in', list(old2new.keys())),
+                            ])
+                    if steps:
+                        step_default['process'] = (
+                            lambda data, old2new=old2new:
+                            old2new[data['process']])
+                        Step.copy(steps, default=step_default)
+        cls._update_related_costs('id', [p.id for p in new_processes])
+        return new_processes
 
     @classmethod
+    @instrumented
     def write(cls, *args):
         pool = Pool()
         BOM = pool.get('production.bom')
         Route = pool.get('production.route')
+        OutputProduct = pool.get('production.process-product.product')
 
-        bom_args = []
-        route_args = []
+        bom_names = {}
+        route_names = {}
+        bom_ids = set()
+        cost_ids = set()
         actions = iter(args)
         for processes, values in zip(actions, actions):
+            if values.get('bom'):
+                bom_ids.add(values['bom'])
+            if 'bom' in values or 'route' in values:
+                cost_ids.update(p.id for p in processes)
             if values.get('name'):
-                new_values = {
-                    'name': values['name']
-                    }
-
-                if values.get('bom'):
-                    bom_args.extend(([BOM(values['bom'])], new_values))
-                else:
-                    for process in processes:
-                        bom_args.extend(([process.bom], new_values))
-
-                if values.get('route'):
-                    route_args.extend(([Route(values['route'])], new_values))
-                else:
-                    for process in processes:
-                        route_args.extend(([process.route], new_values))
+                name = values['name']
+                bom_routes = cls.get_bom_route([p.id for p in processes])
+                for bom, route in bom_routes.values():
+                    bom_names[values.get('bom') or bom] = name
+                    route_names[values.get('route') or route] = name
 
         super(Process, cls).write(*args)
-        if bom_args:
-            BOM.write(*bom_args)
-        if route_args:
-            Route.write(*route_args)
+        cls._plan_cache.clear()
+        cls._bom_route_cache.clear()
+        if bom_ids:
+            OutputProduct.refresh(bom_ids)
+        cls._update_related_costs('id', cost_ids)
+        for Model, names in [(BOM, bom_names), (Route, route_names)]:
+            name2ids = defaultdict(list)
+            for id_, name in names.items():
+                name2ids[name].append(id_)
+            to_write = []
+            for name, ids in name2ids.items():
+                to_write.extend((Model.browse(ids), {'name': name}))
+            if to_write:
+                Model.write(*to_write)
+
+    @classmethod
+    def check_bom_route_delete(cls, field, records, processes=None):
+        '''
+        Raise an error listing all the BOMs or routes (depending on field) in
+        records that are used by a process other than processes
+        '''
+        exclude = {p.id for p in processes or []}
+        used = []
+        with Transaction().set_context(active_test=False):
+            for sub_records in grouped_slice(records):
+                used.extend(p for p in cls.search([
+                            (field, 'in', [r.id for r in sub_records]),
+                            ])
+                    if p.id not in exclude)
+        if used:
+            if field == 'bom':
+                message = 'production_process.cannot_delete_with_process'
+            else:
+                message = ('production_process'
+                    '.cannot_delete_with_process_route')
+            raise UserError(gettext(message, **{
+                        field: ', '.join(
+                            getattr(p, field).rec_name for p in used),
+                        'process': ', '.join(p.rec_name for p in used),
+                        }))
 
     @classmethod
+    @instrumented
     def delete(cls, processes):
         pool = Pool()
         BOM = pool.get('production.bom')
         Route = pool.get('production.route')
-        boms = []
-        routes = []
-        for process in processes:
-            boms.append(process.bom)
-            routes.append(process.route)
-        super(Process, cls).delete(processes)
-        BOM.delete(boms)
-        Route.delete(routes)
+        bom_routes = cls.get_bom_route([p.id for p in processes])
+        boms = BOM.browse({b for b, _ in bom_routes.values()})
+        routes = Route.browse({r for _, r in bom_routes.values()})
+        # Check at once the BOMs and routes shared with other processes
+        cls.check_bom_route_delete('bom', boms, processes)
+        cls.check_bom_route_delete('route', routes, processes)
+        with Transaction().set_context(_process_costs=False):
+            super(Process, cls).delete(processes)
+            cls._plan_cache.clear()
+            cls._bom_route_cache.clear()
+            with Transaction().set_context(_check_process=False):
+                BOM.delete(boms)
+                Route.delete(routes)
+
+    @classmethod
+    def _exchange_fields(cls):
+        '''
+        Return the list of (model, key, fields) exchanged for the processes
+        where key is the field of the parent record in the exchanged data
+
+        The lines and operations without step are exchanged with the process
+        under the same key as in the steps.
+        '''
+        return [
+            ('production.process', None, ['name', 'uom']),
+            ('production.process.step', 'steps',
+                ['name', 'description', 'sequence']),
+            ('production.bom.input', 'inputs',
+                ['product', 'phantom_bom', 'quantity', 'unit',
+                    'step_sequence']),
+            ('production.bom.output', 'outputs',
+                ['product', 'phantom_bom', 'quantity', 'unit',
+                    'step_sequence']),
+            ('production.route.operation', 'operations',
+                ['sequence', 'operation_type', 'work_center',
+                    'work_center_category', 'time', 'quantity',
+                    'quantity_uom', 'calculation']),
+            ]
+
+    @classmethod
+    def _exchange_keys(cls):
+        '''
+        Return a dictionary mapping the related models to the field that
+        identifies their records between databases and the domain of the
+        records to search
+        '''
+        return {
+            'product.product': ('code', []),
+            'product.uom': ('name', []),
+            'production.bom': ('name', [('phantom', '=', True)]),
+            'production.operation.type': ('name', []),
+            'production.work_center': ('name', []),
+            'production.work_center.category': ('name', []),
+            }
+
+    @classmethod
+    def _exchange_relations(cls):
+        "Yield (model, field, related model) of the exchanged relations"
+        pool = Pool()
+        keys = cls._exchange_keys()
+        for model, _, names in cls._exchange_fields():
+            Model = pool.get(model)
+            for name in names:
+                field = Model._fields[name]
+                if field._type == 'many2one' and field.model_name in keys:
+                    yield model, name, field.model_name
+
+    @classmethod
+    @instrumented
+    def export_lines(cls, processes):
+        '''
+        Yield the processes with their steps, lines and operations as JSON
+        lines
+
+        The processes are read by batch and the related records are written
+        with their key from _exchange_keys so the lines can be imported in
+        another database.
+        '''
+        pool = Pool()
+        Model = pool.get('ir.model')
+        keys = cls._exchange_keys()
+        relations = list(cls._exchange_relations())
+        lines_models = cls._get_lines_models()
+        (_, _, process_fields), (_, _, step_fields), *line_models = (
+            cls._exchange_fields())
+
+        def order(names):
+            return [
+                ('sequence' if 'sequence' in names else 'step_sequence',
+                    'ASC'),
+                ('id', 'ASC'),
+                ]
+
+        with Transaction().set_context(active_test=False):
+            for sub_processes in grouped_slice(processes):
+                ids = [p.id for p in sub_processes]
+                records = {}
+                records['production.process'] = processes_ = (
+                    cls.search_read([
+                            ('id', 'in', ids),
+                            ], order=[('id', 'ASC')],
+                        fields_names=process_fields + ['bom', 'route']))
+                records['production.process.step'] = steps = (
+                    pool.get('production.process.step').search_read([
+                            ('process', 'in', ids),
+                            ], fields_names=step_fields + ['process']))
+                step_ids = [s['id'] for s in steps]
+                process_lines = defaultdict(lambda: defaultdict(list))
+                step_lines = defaultdict(lambda: defaultdict(list))
+                for model, key, names in line_models:
+                    Line = pool.get(model)
+                    parent = lines_models[key][1]
+                    records[model] = lines = Line.search_read([
+                            ('step', 'in', step_ids),
+                            ], order=order(names),
+                        fields_names=names + ['step'])
+                    for line in lines:
+                        step_lines[line.pop('step')][key].append(line)
+                    # Lines without step belong to all the processes of their
+                    # BOM or route
+                    parent2processes = defaultdict(list)
+                    for process in processes_:
+                        parent2processes[process[parent]].append(
+                            process['id'])
+                    lines = Line.search_read([
+                            (parent, 'in', list(parent2processes)),
+                            ('step', '=', None),
+                            ], order=order(names),
+                        fields_names=names + [parent])
+                    records[model].extend(lines)
+                    for line in lines:
+                        for process_id in parent2processes[line.pop(parent)]:
+                            process_lines[process_id][key].append(line)
+
+                # Replace the ids of the related records by their key
+                related = defaultdict(set)
+                for model, name, target in relations:
+                    related[target].update(r[name] for r in records[model]
+                        if r[name] is not None)
+                id2key = {}
+                for target, target_ids in related.items():
+                    Target = pool.get(target)
+                    key, _ = keys[target]
+                    id2key[target] = {
+                        r['id']: r[key]
+                        for r in Target.search_read([
+                                ('id', 'in', list(target_ids)),
+                                ], fields_names=[key])}
+                    missing = [i for i, k in id2key[target].items()
+                        if k is None]
+                    if missing:
+                        raise UserError(gettext(
+                                'production_process.msg_export_missing_key',
+                                model=Model.get_name(target),
+                                field=key,
+                                records=', '.join(
+                                    r.rec_name
+                                    for r in Target.browse(missing[:5]))))
+                for model, name, target in relations:
+                    for record in records[model]:
+                        if record[name] is not None:
+                            record[name] = id2key[target][record[name]]
+
+                process_steps = defaultdict(list)
+                for step in steps:
+                    step_id = step.pop('id')
+                    for _, key, _ in line_models:
+                        step[key] = step_lines[step_id][key]
+                    process_steps[step.pop('process')].append(step)
+                for process in processes_:
+                    process_id = process.pop('id')
+                    del process['bom'], process['route']
+                    process['steps'] = process_steps[process_id]
+                    for _, key, _ in line_models:
+                        process[key] = process_lines[process_id][key]
+                    yield json.dumps(process, sort_keys=True)
+
+    @classmethod
+    @instrumented
+    def import_lines(cls, lines, count=None):
+        '''
+        Create the processes from the JSON lines of export_lines and return
+        the number of processes created
+
+        The lines are consumed by batch of count processes so they can be
+        streamed from a file.
+        '''
+        pool = Pool()
+        Model = pool.get('ir.model')
+        keys = cls._exchange_keys()
+        relations = list(cls._exchange_relations())
+        lines_models = cls._get_lines_models()
+        _, _, *line_models = cls._exchange_fields()
+        if count is None:
+            count = Transaction().database.IN_MAX
+
+        def records(process):
+            "Yield the records of process per model"
+            yield 'production.process', process
+            for model, key, _ in line_models:
+                for line in process.get(key, []):
+                    yield model, line
+            for step in process['steps']:
+                yield 'production.process.step', step
+                for model, key, _ in line_models:
+                    for line in step[key]:
+                        yield model, line
+
+        lines = iter(lines)
+        created = 0
+        while True:
+            batch = [json.loads(line) for line in islice(lines, count)
+                if line.strip()]
+            if not batch:
+                break
+            related = defaultdict(set)
+            for process in batch:
+                for model, record in records(process):
+                    for model_, name, target in relations:
+                        if model_ == model and record[name] is not None:
+                            related[target].add(record[name])
+            key2id = {}
+            for target, target_keys in related.items():
+                key, domain = keys[target]
+                key2id[target] = target_ids = defaultdict(list)
+                with Transaction().set_context(active_test=False):
+                    for record in pool.get(target).search_read([
+                                (key, 'in', list(target_keys)),
+                                ] + domain, fields_names=[key]):
+                        target_ids[record[key]].append(record['id'])
+                for message, wrong in [
+                        ('production_process.msg_import_unknown_key',
+                            target_keys - target_ids.keys()),
+                        ('production_process.msg_import_duplicated_key',
+                            {k for k, i in target_ids.items() if len(i) > 1}),
+                        ]:
+                    if wrong:
+                        raise UserError(gettext(message,
+                                model=Model.get_name(target),
+                                keys=', '.join(sorted(map(str, wrong)))))
+            to_create = []
+            for process in batch:
+                for model, record in records(process):
+                    for model_, name, target in relations:
+                        if model_ == model and record[name] is not None:
+                            record[name], = key2id[target][record[name]]
+                to_create.append({key: process.pop(key, [])
+                        for _, key, _ in line_models})
+                for step in process['steps']:
+                    for _, key, _ in line_models:
+                        step[key] = [('create', step[key])]
+                process['steps'] = [('create', process['steps'])]
+            processes = cls.create(batch)
+            created += len(processes)
+
+            # Lines without step are created once the BOM and route exist
+            bom_routes = cls.get_bom_route([p.id for p in processes])
+            for model, key, _ in line_models:
+                parent = lines_models[key][1]
+                index = 0 if parent == 'bom' else 1
+                vlist = [dict(line, **{parent: bom_routes[p.id][index]})
+                    for p, values in zip(processes, to_create)
+                    for line in values[key]]
+                if vlist:
+                    pool.get(model).create(vlist)
+        return created
+
+
+class ProcessOutputProduct(ModelSQL):
+    'Production Process - Output Product'
+    __name__ = 'production.process-product.product'
+    process = fields.Many2One('production.process', 'Process', required=True,
+        ondelete='CASCADE')
+    product = fields.Many2One('product.product', 'Product', required=True,
+        ondelete='CASCADE')
+
+    @classmethod
+    def __setup__(cls):
+        super(ProcessOutputProduct, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('process_product_uniq', Unique(t, t.process, t.product),
+                'production_process.msg_process_output_product_unique'),
+            ]
+        cls._sql_indexes.add(
+            Index(t, (t.product, Index.Equality()),
+                (t.process, Index.Range())))
+
+    @classmethod
+    def __register__(cls, module_name):
+        exist = backend.TableHandler.table_exist(cls._table)
+        super(ProcessOutputProduct, cls).__register__(module_name)
+        if not exist:
+            cls.refresh()
+
+    @classmethod
+    def refresh(cls, bom_ids=None):
+        '''
+        Rebuild the output products of the processes using the BOMs or of all
+        processes if bom_ids is None
+        '''
+        pool = Pool()
+        Process = pool.get('production.process')
+        BOMOutput = pool.get('production.bom.output')
+        table = cls.__table__()
+        process = Process.__table__()
+        output = BOMOutput.__table__()
+        cursor = Transaction().connection.cursor()
+
+        if bom_ids is None:
+            wheres = [None]
+        else:
+            wheres = [reduce_ids(process.bom, sub_ids)
+                for sub_ids in grouped_slice(bom_ids)]
+        for where in wheres:
+            # Phantom outputs have no product
+            output_where = output.product != Null
+            if where is None:
+                cursor.execute(*table.delete())
+            else:
+                cursor.execute(*table.delete(
+                        where=table.process.in_(
+                            process.select(process.id, where=where))))
+                output_where &= where
+            cursor.execute(*table.insert(
+                    [table.process, table.product],
+                    process.join(output,
+                        condition=process.bom == output.bom
+                        ).select(process.id, output.product,
+                        where=output_where,
+                        group_by=[process.id, output.product])))
+
+
+class ProcessCost(ModelSQL):
+    'Production Process Cost'
+    __name__ = 'production.process.cost'
+    company = fields.Many2One('company.company', 'Company', required=True,
+        ondelete='CASCADE')
+    process = fields.Many2One('production.process', 'Process', required=True,
+        ondelete='CASCADE')
+    step = fields.Many2One('production.process.step', 'Step',
+        ondelete='CASCADE', help='Empty for the cost of the whole process.')
+    input_cost = fields.Numeric('Input Cost', digits=price_digits,
+        required=True)
+    operation_cost = fields.Numeric('Operation Cost', digits=price_digits,
+        required=True)
+    cost = fields.Numeric('Cost', digits=price_digits, required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(ProcessCost, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t, (t.process, Index.Range()),
+                    (t.company, Index.Range())),
+                Index(t, (t.step, Index.Range()), (t.company, Index.Range()),
+                    where=t.step != Null),
+                })
+
+    @classmethod
+    def get_costs(cls, field, records):
+        '''
+        Return a dictionary mapping the ids of the records, processes or steps
+        depending on field, to their stored cost for the company of the
+        context
+        '''
+        company = Transaction().context.get('company')
+        result = dict.fromkeys([r.id for r in records])
+        if not company:
+            return result
+        domain = [('company', '=', company)]
+        if field == 'process':
+            domain.append(('step', '=', None))
+        for sub_records in grouped_slice(records):
+            for cost in cls.search_read(domain + [
+                        (field, 'in', [r.id for r in sub_records]),
+                        ], fields_names=[field, 'cost']):
+                result[cost[field]] = cost['cost']
+        return result
 
 
 class Step(ModelSQL, ModelView):
@@ -190,11 +1409,18 @@ class Step(ModelSQL, ModelView):
         context={
             'from_step': Eval('id'),
             },)
+    cost = fields.Function(fields.Numeric('Cost', digits=price_digits,
+            help='The cost of the inputs and operations of the step.'),
+        'get_cost')
 
     @classmethod
     def __setup__(cls):
         super(Step, cls).__setup__()
         cls._order.insert(0, ('sequence', 'ASC'))
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t, (t.process, Index.Range()), (t.sequence, Index.Range()),
+                where=t.process != Null))
 
     @staticmethod
     def order_sequence(tables):
@@ -202,6 +1428,82 @@ class Step(ModelSQL, ModelView):
         return [table.sequence == None, table.sequence]
 
     @classmethod
+    def get_cost(cls, steps, name):
+        ProcessCost = Pool().get('production.process.cost')
+        return ProcessCost.get_costs('step', steps)
+
+    @classmethod
+    def get_bom_route(cls, step_ids):
+        '''
+        Return a dictionary mapping each step id to the (bom, route) ids of
+        its process
+        '''
+        pool = Pool()
+        Process = pool.get('production.process')
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        step2process = {}
+        for sub_ids in grouped_slice(step_ids):
+            cursor.execute(*table.select(table.id, table.process,
+                    where=reduce_ids(table.id, sub_ids)
+                    & (table.process != Null)))
+            step2process.update(cursor)
+        bom_routes = Process.get_bom_route(set(step2process.values()))
+        result = dict.fromkeys(step_ids, (None, None))
+        for step_id, process_id in step2process.items():
+            result[step_id] = bom_routes.get(process_id, (None, None))
+        return result
+
+    @classmethod
+    def create(cls, vlist):
+        Process = Pool().get('production.process')
+        steps = super(Step, cls).create(vlist)
+        Process._plan_cache.clear()
+        Process._update_related_costs(
+            'id', {s.process.id for s in steps if s.process})
+        return steps
+
+    @classmethod
+    def write(cls, *args):
+        Process = Pool().get('production.process')
+        process_ids = set()
+        actions = iter(args)
+        for steps, values in zip(actions, actions):
+            if 'process' in values:
+                process_ids.update(s.process.id for s in steps if s.process)
+                if values['process']:
+                    process_ids.add(values['process'])
+        super(Step, cls).write(*args)
+        Process._plan_cache.clear()
+        Process._update_related_costs('id', process_ids)
+
+    @classmethod
+    def delete(cls, steps):
+        pool = Pool()
+        Process = pool.get('production.process')
+        BOM = pool.get('production.bom')
+        process_ids = {s.process.id for s in steps if s.process}
+        # The lines lose their step so their step sequence is meaningless
+        cursor = Transaction().connection.cursor()
+        for Line in [
+                pool.get('production.bom.input'),
+                pool.get('production.bom.output'),
+                ]:
+            table = Line.__table__()
+            for sub_steps in grouped_slice(steps):
+                cursor.execute(*table.update(
+                        [table.step_sequence], [Null],
+                        where=reduce_ids(
+                            table.step, [s.id for s in sub_steps])))
+        super(Step, cls).delete(steps)
+        Process._plan_cache.clear()
+        # Inputs lose their step on delete
+        BOM._input_steps_cache.clear()
+        Process._update_related_costs('id', process_ids)
+
+    @classmethod
+    @instrumented
     def copy(cls, steps, default=None):
         pool = Pool()
         BOMInput = pool.get('production.bom.input')
@@ -216,23 +1518,29 @@ class Step(ModelSQL, ModelView):
         default['outputs'] = None
         default['operations'] = None
 
-        res = []
-        for step in steps:
-            new_step, = super(Step, cls).copy([step], default=default)
-            BOMInput.copy(step.inputs, {
-                    'step': new_step.id,
-                    'bom': new_step.process.bom.id if new_step.process else None,
-                    })
-            BOMOutput.copy(step.outputs, {
-                    'step': new_step.id,
-                    'bom': new_step.process.bom.id if new_step.process else None,
-                    })
-            Operation.copy(step.operations, {
-                    'step': new_step.id,
-                    'route': new_step.process.route.id if new_step.process else None,
-                    })
-            res.append(new_step)
-        return res
+        new_steps = super(Step, cls).copy(steps, default=default)
+        bom_routes = cls.get_bom_route([s.id for s in new_steps])
+        for old2new in _old2new(steps, new_steps):
+
+            def step(data, old2new=old2new):
+                return old2new[data['step']]
+
+            def bom(data):
+                return bom_routes[step(data)][0]
+
+            def route(data):
+                return bom_routes[step(data)][1]
+
+            step_ids = list(old2new.keys())
+            for Line, values in [
+                    (BOMInput, {'step': step, 'bom': bom}),
+                    (BOMOutput, {'step': step, 'bom': bom}),
+                    (Operation, {'step': step, 'route': route}),
+                    ]:
+                lines = Line.search([('step', 'in', step_ids)])
+                if lines:
+                    Line.copy(lines, default=values)
+        return new_steps
 
 
 class BOMMixin(metaclass=PoolMeta):
@@ -240,23 +1548,156 @@ class BOMMixin(metaclass=PoolMeta):
     step_sequence = fields.Integer('Step Sequence')
 
     @classmethod
+    def __setup__(cls):
+        super(BOMMixin, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t, (t.step, Index.Range()), (t.step_sequence, Index.Range()),
+                where=t.step != Null))
+
+    @classmethod
+    @instrumented
     def create(cls, vlist):
         pool = Pool()
+        Process = pool.get('production.process')
         Step = pool.get('production.process.step')
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if not values.get('bom') and values.get('step'):
-                values['bom'] = Step(values['step']).process.bom.id
-        return super(BOMMixin, cls).create(vlist)
+        step_ids = {v['step'] for v in vlist
+            if not v.get('bom') and v.get('step')}
+        if step_ids:
+            bom_routes = Step.get_bom_route(step_ids)
+            for values in vlist:
+                if not values.get('bom') and values.get('step'):
+                    values['bom'], _ = bom_routes[values['step']]
+        lines = super(BOMMixin, cls).create(vlist)
+        cls._append_to_steps([line for line, values in zip(lines, vlist)
+                if values.get('step') and values.get('step_sequence') is None])
+        Process._plan_cache.clear()
+        Process._update_related_costs(
+            'bom', {line.bom.id for line in lines if line.step})
+        return lines
+
+    @classmethod
+    def write(cls, *args):
+        Process = Pool().get('production.process')
+        bom_ids = set()
+        to_append = []
+        actions = iter(args)
+        for lines, values in zip(actions, actions):
+            bom_ids.update(line.bom.id for line in lines)
+            if values.get('bom'):
+                bom_ids.add(values['bom'])
+            if values.get('step') and 'step_sequence' not in values:
+                to_append.extend(lines)
+        super(BOMMixin, cls).write(*args)
+        cls._append_to_steps(to_append)
+        Process._plan_cache.clear()
+        Process._update_related_costs('bom', bom_ids)
+
+    @classmethod
+    def _append_to_steps(cls, lines):
+        '''
+        Set the step sequence of the lines after the other lines of their step
+        with a single update per batch
+        '''
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        for sub_lines in grouped_slice(lines):
+            ids = [line.id for line in sub_lines]
+            steps = cls.__table__()
+            other = cls.__table__()
+            # Only the lines of the steps of the batch are aggregated
+            last = other.select(other.step,
+                Max(Coalesce(other.step_sequence, 0)).as_('sequence'),
+                where=~reduce_ids(other.id, ids)
+                & other.step.in_(steps.select(steps.step,
+                        where=reduce_ids(steps.id, ids))),
+                group_by=[other.step])
+            batch = cls.__table__()
+            position = batch.select(batch.id, batch.step,
+                RowNumber(window=Window([batch.step],
+                        order_by=[batch.id.asc])).as_('position'),
+                where=reduce_ids(batch.id, ids))
+            query = (position
+                .join(last, 'LEFT', condition=position.step == last.step)
+                .select(position.id.as_('id'),
+                    (Coalesce(last.sequence, 0) + position.position
+                        ).as_('sequence')))
+            cursor.execute(*table.update(
+                    [table.step_sequence], [query.sequence],
+                    from_=[query],
+                    where=table.id == query.id))
+
+    @classmethod
+    def delete(cls, lines):
+        Process = Pool().get('production.process')
+        bom_ids = {line.bom.id for line in lines if line.step}
+        super(BOMMixin, cls).delete(lines)
+        Process._plan_cache.clear()
+        Process._update_related_costs('bom', bom_ids)
 
 
 class BOMInput(BOMMixin):
     __name__ = 'production.bom.input'
 
+    @classmethod
+    def __setup__(cls):
+        super(BOMInput, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t, (t.product, Index.Range()), (t.bom, Index.Range())))
+
+    @classmethod
+    def create(cls, vlist):
+        BOM = Pool().get('production.bom')
+        inputs = super(BOMInput, cls).create(vlist)
+        BOM._input_steps_cache.clear()
+        return inputs
+
+    @classmethod
+    def write(cls, *args):
+        BOM = Pool().get('production.bom')
+        super(BOMInput, cls).write(*args)
+        BOM._input_steps_cache.clear()
+
+    @classmethod
+    def delete(cls, inputs):
+        BOM = Pool().get('production.bom')
+        super(BOMInput, cls).delete(inputs)
+        BOM._input_steps_cache.clear()
+
 
 class BOMOutput(BOMMixin):
     __name__ = 'production.bom.output'
 
+    @classmethod
+    def create(cls, vlist):
+        OutputProduct = Pool().get('production.process-product.product')
+        outputs = super(BOMOutput, cls).create(vlist)
+        OutputProduct.refresh({o.bom.id for o in outputs})
+        return outputs
+
+    @classmethod
+    def write(cls, *args):
+        OutputProduct = Pool().get('production.process-product.product')
+        bom_ids = set()
+        actions = iter(args)
+        for outputs, values in zip(actions, actions):
+            if 'bom' in values or 'product' in values:
+                bom_ids.update(o.bom.id for o in outputs)
+                if values.get('bom'):
+                    bom_ids.add(values['bom'])
+        super(BOMOutput, cls).write(*args)
+        if bom_ids:
+            OutputProduct.refresh(bom_ids)
+
+    @classmethod
+    def delete(cls, outputs):
+        OutputProduct = Pool().get('production.process-product.product')
+        bom_ids = {o.bom.id for o in outputs}
+        super(BOMOutput, cls).delete(outputs)
+        OutputProduct.refresh(bom_ids)
+
 
 class Operation(metaclass=PoolMeta):
     __name__ = 'production.route.operation'
@@ -275,35 +1716,86 @@ class Operation(metaclass=PoolMeta):
         cls.route.states.update({
                 'readonly': new_readonly,
                 })
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t, (t.step, Index.Range()), (t.sequence, Index.Range()),
+                where=t.step != Null))
 
     @staticmethod
     def default_route():
         return Transaction().context.get('from_route')
 
     @classmethod
+    @instrumented
     def create(cls, vlist):
         pool = Pool()
+        Process = pool.get('production.process')
         Step = pool.get('production.process.step')
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if not values.get('route') and values.get('step'):
-                values['route'] = Step(values['step']).process.route.id
-        return super(Operation, cls).create(vlist)
+        step_ids = {v['step'] for v in vlist
+            if not v.get('route') and v.get('step')}
+        if step_ids:
+            bom_routes = Step.get_bom_route(step_ids)
+            for values in vlist:
+                if not values.get('route') and values.get('step'):
+                    _, values['route'] = bom_routes[values['step']]
+        operations = super(Operation, cls).create(vlist)
+        Process._plan_cache.clear()
+        Process._update_related_costs(
+            'route', {o.route.id for o in operations if o.step})
+        return operations
+
+    @classmethod
+    def write(cls, *args):
+        Process = Pool().get('production.process')
+        route_ids = set()
+        actions = iter(args)
+        for operations, values in zip(actions, actions):
+            route_ids.update(o.route.id for o in operations)
+            if values.get('route'):
+                route_ids.add(values['route'])
+        super(Operation, cls).write(*args)
+        Process._plan_cache.clear()
+        Process._update_related_costs('route', route_ids)
+
+    @classmethod
+    def delete(cls, operations):
+        Process = Pool().get('production.process')
+        route_ids = {o.route.id for o in operations if o.step}
+        super(Operation, cls).delete(operations)
+        Process._plan_cache.clear()
+        Process._update_related_costs('route', route_ids)
 
 
 class BOM(metaclass=PoolMeta):
     __name__ = 'production.bom'
+    _input_steps_cache = Cache('production.bom.input_steps', context=False)
+
+    @instrumented
+    def get_input_steps(self):
+        '''
+        Return a dictionary mapping the products of the inputs to their step
+        '''
+        pool = Pool()
+        BOMInput = pool.get('production.bom.input')
+
+        input_steps = self._input_steps_cache.get(self.id)
+        if input_steps is not None:
+            return input_steps
+
+        table = BOMInput.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(table.product, table.step,
+                where=(table.bom == self.id) & (table.step != Null),
+                order_by=table.id.asc))
+        input_steps = dict(cursor)
+        return self._input_steps_cache.set(self.id, input_steps)
 
     @classmethod
     def delete(cls, boms):
         Process = Pool().get('production.process')
-        processes = Process.search([('bom', 'in', [x.id for x in boms])],
-            limit=1)
-        if processes:
-            raise UserError(gettext(
-                'production_process.cannot_delete_with_process',
-                    bom=processes[0].bom.rec_name,
-                    process=processes[0].rec_name))
+        if Transaction().context.get('_check_process', True):
+            Process.check_bom_route_delete('bom', boms)
         super(BOM, cls).delete(boms)
 
 
@@ -313,14 +1805,8 @@ class Route(metaclass=PoolMeta):
     @classmethod
     def delete(cls, routes):
         Process = Pool().get('production.process')
-        processes = Process.search([('route', 'in', [x.id for x in routes])],
-            limit=1)
-        if processes:
-            process, = processes
-            raise UserError(gettext(
-                'production_process.cannot_delete_with_process_route',
-                    route=process.route.rec_name,
-                    process=process.rec_name))
+        if Transaction().context.get('_check_process', True):
+            Process.check_bom_route_delete('route', routes)
         super(Route, cls).delete(routes)
 
 
@@ -336,6 +1822,8 @@ class Production(metaclass=PoolMeta):
                 | ~Eval('warehouse', 0) | ~Eval('location', 0)),
             'invisible': ~Eval('product'),
             })
+    step_schedules = fields.One2Many('production.step.schedule',
+        'production', 'Step Schedules', readonly=True)
 
     @classmethod
     def __setup__(cls):
@@ -351,37 +1839,323 @@ class Production(metaclass=PoolMeta):
                 'readonly': Bool(Eval('process')),
                 })
         cls.route.depends.add('process')
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t, (t.process, Index.Equality()),
+                where=t.process != Null))
 
     @fields.depends('process', methods=['on_change_route', 'explode_bom'])
+    @instrumented
     def on_change_process(self):
         if self.process:
-            self.bom = self.process.bom
-            self.route = self.process.route
+            plan = self.process.get_plan()
+            self.bom = plan['bom']
+            self.route = plan['route']
             self.on_change_route()
             self.explode_bom()
 
+    @fields.depends('process', 'type', 'bom', 'product', 'unit', 'quantity',
+        methods=['_move'])
+    @instrumented
+    def explode_bom(self):
+        pool = Pool()
+        BOMInput = pool.get('production.bom.input')
+        BOMOutput = pool.get('production.bom.output')
+
+        plan = self.process.get_plan() if self.process else None
+        if (not plan or not (self.bom and self.product and self.unit)
+                or self.bom.id != plan['bom'] or self.bom.phantom):
+            super().explode_bom()
+            return
+
+        # Same as the standard explosion but with the BOM lines of the plan
+        inputs = [BOMInput(**v) for v in plan['inputs']]
+        outputs = [BOMOutput(**v) for v in plan['outputs']]
+        factor = self.process.compute_factor(
+            self.product, self.quantity or 0, self.unit,
+            type='inputs' if self.type == 'disassembly' else 'outputs') or 0
+
+        moves = []
+        for input_ in inputs:
+            quantity = input_.compute_quantity(factor)
+            for line, quantity in input_.lines_for_quantity(quantity):
+                move = self._move('input', line.product, line.unit, quantity)
+                moves.append(input_.prepare_move(self, move))
+        self.inputs = moves
+
+        moves = []
+        for output in outputs:
+            quantity = output.compute_quantity(factor)
+            for line, quantity in output.lines_for_quantity(quantity):
+                move = self._move('output', line.product, line.unit, quantity)
+                moves.append(output.prepare_move(self, move))
+        self.outputs = moves
+
     @classmethod
+    @instrumented
+    def apply_process(cls, productions, process):
+        '''
+        Set process to the request and draft productions and explode their BOM
+
+        The productions are exploded from the plan of the process, which is
+        compiled once for all of them, and saved at once so their previous
+        moves are deleted and the new ones created in bulk.
+        '''
+        productions = [p for p in productions
+            if p.state in {'request', 'draft'}]
+        for production in productions:
+            production.process = process
+            production.on_change_process()
+        cls.save(productions)
+
+    @classmethod
+    @instrumented
+    def generate_requests(cls, clean=True, warehouses=None, products=None):
+        '''
+        Inherited from stock_supply_production
+
+        If products is set, only the requests of those products are generated.
+
+        When the supply is split into partitions, the requests are generated
+        by queue tasks and an empty list is returned; the tasks run in
+        parallel on the workers, or one after the other once the transaction
+        is committed when no worker is configured.
+        '''
+        context = Transaction().context
+        partitions = context.get('supply_partitions', SUPPLY_PARTITIONS) or 1
+        if partitions > 1 and products is None:
+            cls.generate_requests_parallel(
+                partitions, clean=clean, warehouses=warehouses)
+            return []
+        partition = [p.id for p in products] if products is not None else None
+        # Processes are set in batch once all the requests are created
+        with Transaction().set_context(
+                _request_process=False, _supply_partition=partition):
+            requests = super(Production, cls).generate_requests(
+                clean=clean, warehouses=warehouses)
+        if requests:
+            cls.set_request_process(requests)
+        return requests
+
+    @classmethod
+    def _supply_products_domain(cls):
+        "Return the domain of the products supplied by generate_requests"
+        return [
+            ('type', '=', 'goods'),
+            ('consumable', '=', False),
+            ('producible', '=', True),
+            ]
+
+    @classmethod
+    def generate_requests_parallel(cls, partitions, clean=True,
+            warehouses=None):
+        '''
+        Split the products to supply into partitions and queue the generation
+        of their requests
+
+        Each partition is generated in its own transaction by a queue task so
+        the partitions run in parallel on the trytond-worker processes, or one
+        after the other once the transaction is committed when no worker is
+        configured. Together the requests of the partitions are the same as
+        the ones of generate_requests.
+        Return the ids of the queued tasks.
+        '''
+        pool = Pool()
+        Product = pool.get('product.product')
+        User = pool.get('res.user')
+        company = User(Transaction().user).company
+        if not company:
+            return []
+
+        if clean:
+            requests = cls.search([
+                    ('state', '=', 'request'),
+                    ('company', '=', company.id),
+                    ('origin', 'like', 'stock.order_point,%'),
+                    ])
+            if warehouses:
+                requests = [r for r in requests if r.warehouse in warehouses]
+            cls.delete(requests)
+
+        products = Product.search(
+            cls._supply_products_domain(), order=[('id', 'ASC')])
+        warehouse_ids = [w.id for w in warehouses] if warehouses else None
+        tasks = []
+        for i in range(partitions):
+            partition = products[i::partitions]
+            if partition:
+                tasks.extend(Product.__queue__.supply_production_requests(
+                        partition, warehouse_ids))
+        return tasks
+
+    @classmethod
+    @instrumented
     def compute_request(cls, product, warehouse, quantity, date, company,
             order_point=None):
         "Inherited from stock_supply_production"
         production = super(Production, cls).compute_request(product,
             warehouse, quantity, date, company, order_point)
-        if product.boms:
+        if (Transaction().context.get('_request_process', True)
+                and product.boms):
             production.process = product.boms[0].process
         return production
 
+    @classmethod
+    @instrumented
+    def set_request_process(cls, productions):
+        '''
+        Set the default process of their product to the productions
+        '''
+        pool = Pool()
+        ProductBom = pool.get('product.product-production.bom')
+
+        product_processes = ProductBom.get_default_processes(
+            {p.product.id for p in productions if p.product})
+        process2productions = defaultdict(list)
+        for production in productions:
+            if not production.product:
+                continue
+            process = product_processes.get(production.product.id)
+            if process:
+                process2productions[process].append(production)
+        to_write = []
+        for process, sub_productions in process2productions.items():
+            to_write.extend((sub_productions, {'process': process}))
+        if to_write:
+            cls.write(*to_write)
+
+    @classmethod
+    def _schedule_states(cls):
+        return ['request', 'draft', 'waiting', 'assigned', 'running']
+
+    @classmethod
+    @instrumented
+    def schedule_steps(cls, productions=None):
+        '''
+        Plan the steps of the open productions with process on the work
+        centers of their operations and store their planned start and end
+
+        A work center (or the category of operations without work center)
+        runs a single operation at a time. Running productions come first and
+        then the productions by planned date. All the open productions are
+        planned if productions is None, otherwise only the given productions
+        compete for the work centers.
+        '''
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Process = pool.get('production.process')
+        StepSchedule = pool.get('production.step.schedule')
+        schedule_table = StepSchedule.__table__()
+        cursor = Transaction().connection.cursor()
+
+        domain = [
+            ('process', '!=', None),
+            ('state', 'in', cls._schedule_states()),
+            ]
+        if productions is None:
+            cursor.execute(*schedule_table.delete())
+        else:
+            production_ids = [p.id for p in productions]
+            for sub_ids in grouped_slice(production_ids):
+                cursor.execute(*schedule_table.delete(
+                        where=reduce_ids(schedule_table.production, sub_ids)))
+            domain.append(('id', 'in', production_ids))
+        productions = cls.search_read(domain, fields_names=[
+                'process', 'quantity', 'unit', 'state', 'planned_date',
+                'planned_start_date'])
+
+        now = datetime.datetime.now()
+        processes = {p.id: p for p in Process.browse(
+                {p['process'] for p in productions})}
+        jobs = []
+        for production in productions:
+            date = (production['planned_start_date']
+                or production['planned_date'])
+            start = now
+            if date and production['state'] != 'running':
+                start = max(now,
+                    datetime.datetime.combine(date, datetime.time()))
+            priority = (production['state'] != 'running',
+                date or datetime.date.max, production['id'])
+            unit = production['unit'] and Uom(production['unit'])
+            tasks = processes[production['process']].compute_tasks(
+                production['quantity'], unit)
+            jobs.append((priority, start, tasks))
+
+        to_create = []
+        for production, tasks in zip(productions, schedule(jobs)):
+            steps = {}
+            for step, start, end in tasks:
+                if step in steps:
+                    start = min(start, steps[step][0])
+                    end = max(end, steps[step][1])
+                steps[step] = (start, end)
+            to_create.extend({
+                    'production': production['id'],
+                    'step': step,
+                    'planned_start_date': start,
+                    'planned_end_date': end,
+                    } for step, (start, end) in steps.items())
+        StepSchedule.create(to_create)
+
+    @fields.depends('bom')
+    @instrumented
     def _move(self, type, product, unit, quantity):
         move = super()._move(type, product, unit, quantity)
-        if hasattr(move, 'production_input') and move.production_input and move.production_input.bom:
-            for input in move.production_input.bom.inputs:
-                if not input.step:
-                    continue
-                if input.product == move.product:
-                    move.production_step = input.step
+        if type == 'input' and self.bom and product:
+            step = self.bom.get_input_steps().get(product.id)
+            if step is not None:
+                move.production_step = step
         return move
 
 
+class StepSchedule(ModelSQL, ModelView):
+    'Production Step Schedule'
+    __name__ = 'production.step.schedule'
+    production = fields.Many2One('production', 'Production', required=True,
+        ondelete='CASCADE')
+    step = fields.Many2One('production.process.step', 'Step', required=True,
+        ondelete='CASCADE')
+    planned_start_date = fields.DateTime('Planned Start Date', required=True)
+    planned_end_date = fields.DateTime('Planned End Date', required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(StepSchedule, cls).__setup__()
+        cls._order.insert(0, ('planned_start_date', 'ASC'))
+
+
 class StockMove(metaclass=PoolMeta):
     __name__ = 'stock.move'
 
     production_step = fields.Many2One('production.process.step', 'Process')
+
+    @classmethod
+    def __setup__(cls):
+        super(StockMove, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t, (t.production_step, Index.Range()),
+                (t.product, Index.Range()),
+                where=t.production_step != Null))
+
+
+class ApplyProcessStart(ModelView):
+    'Apply Process to Productions'
+    __name__ = 'production.apply_process.start'
+    process = fields.Many2One('production.process', 'Process', required=True)
+
+
+class ApplyProcess(Wizard):
+    'Apply Process to Productions'
+    __name__ = 'production.apply_process'
+    start = StateView('production.apply_process.start',
+        'production_process.apply_process_start_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Apply', 'apply_', 'tryton-ok', default=True),
+            ])
+    apply_ = StateTransition()
+
+    def transition_apply_(self):
+        self.model.apply_process(self.records, self.start.process)
+        return 'end'
@@ -0,0 +1,173 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from dateutil.relativedelta import relativedelta
+from sql import Null
+from sql.aggregate import Min, Sum
+from sql.conditionals import Case, Coalesce
+from sql.functions import DateTrunc
+
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.pyson import Eval, If
+from trytond.transaction import Transaction
+
+__all__ = ['StepConsumption', 'StepConsumptionContext']
+
+
+class StepConsumption(ModelSQL, ModelView):
+    'Production Step Consumption'
+    __name__ = 'production.step.consumption'
+    company = fields.Many2One('company.company', 'Company')
+    process = fields.Many2One('production.process', 'Process')
+    step = fields.Many2One('production.process.step', 'Step')
+    product = fields.Many2One('product.product', 'Product')
+    unit = fields.Many2One('product.uom', 'Unit')
+    date = fields.Date('Date')
+    planned_quantity = fields.Float('Planned Quantity',
+        digits='unit')
+    actual_quantity = fields.Float('Actual Quantity',
+        digits='unit')
+    wip_quantity = fields.Float('WIP Quantity', digits='unit',
+        help='The quantity still to consume by the running productions.')
+
+    @classmethod
+    def __setup__(cls):
+        super(StepConsumption, cls).__setup__()
+        cls._order.insert(0, ('date', 'DESC'))
+
+    @classmethod
+    def table_query(cls):
+        from_item, tables = cls._joins()
+        return from_item.select(*cls._columns(tables),
+            where=cls._where(tables),
+            group_by=cls._group_by(tables))
+
+    @classmethod
+    def _joins(cls):
+        pool = Pool()
+        Move = pool.get('stock.move')
+        Step = pool.get('production.process.step')
+        Production = pool.get('production')
+        Product = pool.get('product.product')
+        Template = pool.get('product.template')
+
+        tables = {}
+        tables['move'] = move = Move.__table__()
+        tables['move.production_step'] = step = Step.__table__()
+        tables['move.production_input'] = production = Production.__table__()
+        tables['move.product'] = product = Product.__table__()
+        tables['move.product.template'] = template = Template.__table__()
+
+        from_item = (move
+            .join(step, condition=move.production_step == step.id)
+            .join(production,
+                condition=move.production_input == production.id)
+            .join(product, condition=move.product == product.id)
+            .join(template, condition=product.template == template.id))
+        return from_item, tables
+
+    @classmethod
+    def _column_date(cls, tables):
+        move = tables['move']
+        period = Transaction().context.get('period', 'month')
+        return cls.date.sql_cast(DateTrunc(period,
+                Coalesce(move.effective_date, move.planned_date)))
+
+    @classmethod
+    def _columns(cls, tables):
+        move = tables['move']
+        step = tables['move.production_step']
+        production = tables['move.production_input']
+        template = tables['move.product.template']
+        quantity = move.internal_quantity
+        return [
+            Min(move.id).as_('id'),
+            move.company.as_('company'),
+            step.process.as_('process'),
+            move.production_step.as_('step'),
+            move.product.as_('product'),
+            template.default_uom.as_('unit'),
+            cls._column_date(tables).as_('date'),
+            Sum(quantity).as_('planned_quantity'),
+            Sum(Case((move.state == 'done', quantity),
+                    else_=0)).as_('actual_quantity'),
+            Sum(Case(((production.state == 'running')
+                        & (move.state != 'done'), quantity),
+                    else_=0)).as_('wip_quantity'),
+            ]
+
+    @classmethod
+    def _group_by(cls, tables):
+        move = tables['move']
+        step = tables['move.production_step']
+        template = tables['move.product.template']
+        return [move.company, step.process, move.production_step,
+            move.product, template.default_uom, cls._column_date(tables)]
+
+    @classmethod
+    def _where(cls, tables):
+        context = Transaction().context
+        move = tables['move']
+
+        where = move.production_step != Null
+        where &= move.state != 'cancelled'
+        where &= move.company == context.get('company')
+        date = Coalesce(move.effective_date, move.planned_date)
+        if context.get('from_date'):
+            where &= date >= context['from_date']
+        if context.get('to_date'):
+            where &= date <= context['to_date']
+        if context.get('process'):
+            step = tables['move.production_step']
+            where &= step.process == context['process']
+        return where
+
+
+class StepConsumptionContext(ModelView):
+    'Production Step Consumption Context'
+    __name__ = 'production.step.consumption.context'
+    company = fields.Many2One('company.company', 'Company', required=True)
+    from_date = fields.Date('From Date',
+        domain=[
+            If(Eval('to_date') & Eval('from_date'),
+                ('from_date', '<=', Eval('to_date')),
+                ()),
+            ])
+    to_date = fields.Date('To Date',
+        domain=[
+            If(Eval('from_date') & Eval('to_date'),
+                ('to_date', '>=', Eval('from_date')),
+                ()),
+            ])
+    period = fields.Selection([
+            ('year', 'Year'),
+            ('month', 'Month'),
+            ('day', 'Day'),
+            ], 'Period', required=True)
+    process = fields.Many2One('production.process', 'Process')
+
+    @classmethod
+    def default_company(cls):
+        return Transaction().context.get('company')
+
+    @classmethod
+    def default_from_date(cls):
+        pool = Pool()
+        Date = pool.get('ir.date')
+        context = Transaction().context
+        if 'from_date' in context:
+            return context['from_date']
+        return Date.today() - relativedelta(years=1)
+
+    @classmethod
+    def default_to_date(cls):
+        pool = Pool()
+        Date = pool.get('ir.date')
+        context = Transaction().context
+        if 'to_date' in context:
+            return context['to_date']
+        return Date.today()
+
+    @classmethod
+    def default_period(cls):
+        return Transaction().context.get('period', 'month')
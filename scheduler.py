@@ -0,0 +1,40 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import heapq
+
+__all__ = ['schedule']
+
+
+def schedule(jobs):
+    '''
+    Lay out the tasks of the jobs on finite capacity resources
+
+    jobs is a list of (priority, start, tasks) where tasks is the ordered list
+    of (key, resource, duration) to run one after the other. A resource runs
+    a single task at a time and a task without resource never waits.
+
+    The ready tasks are dispatched from a priority queue ordered by their
+    ready time and the priority of their job, so each resource is given to
+    the most urgent job that can use it first.
+
+    Return for each job the list of (key, start, end) of its tasks.
+    '''
+    result = [[] for _ in jobs]
+    queue = [(start, priority, i, 0)
+        for i, (priority, start, tasks) in enumerate(jobs) if tasks]
+    heapq.heapify(queue)
+    available = {}
+    while queue:
+        ready, priority, i, j = heapq.heappop(queue)
+        tasks = jobs[i][2]
+        key, resource, duration = tasks[j]
+        start = ready
+        if resource is not None:
+            start = max(start, available.get(resource, start))
+        end = start + duration
+        if resource is not None:
+            available[resource] = end
+        result[i].append((key, start, end))
+        if j + 1 < len(tasks):
+            heapq.heappush(queue, (end, priority, i, j + 1))
+    return result
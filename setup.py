@@ -50,6 +50,7 @@ requires.append(get_require_version('trytond'))
 
 tests_require = [
     get_require_version('proteus'),
+    get_require_version('trytond_stock_supply_production'),
 ]
 
 series = '%s.%s' % (major_version, minor_version)
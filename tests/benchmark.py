@@ -0,0 +1,569 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+'''
+Benchmarks of the production process module
+
+They are not part of the test suite. Run them on a local SQLite database
+with:
+
+    TRYTOND_DATABASE_URI=sqlite:// DB_NAME=:memory: python -m unittest \\
+        trytond.modules.production_process.tests.benchmark
+
+The size of the generated data is set with the BENCHMARK_* environment
+variables. Each benchmark runs with a small and a large size (BENCHMARK_SCALE
+times the small one) and fails if the lookup queries or the time per record
+grow more than the allowed factors. The results are logged at the INFO level.
+'''
+import logging
+import os
+import time
+import unittest
+from contextlib import contextmanager
+from decimal import Decimal
+from unittest.mock import patch
+
+from trytond.modules.company.tests import create_company, set_company
+from trytond.pool import Pool
+from trytond.tests.test_tryton import (
+    activate_module, drop_db, with_transaction)
+from trytond.transaction import Transaction
+
+from .tools import count_queries, create_product, run_queue
+
+try:
+    from trytond.modules import stock_supply_production
+except ImportError:
+    stock_supply_production = None
+
+PROCESSES = int(os.environ.get('BENCHMARK_PROCESSES', 10))
+STEPS = int(os.environ.get('BENCHMARK_STEPS', 5))
+INPUTS = int(os.environ.get('BENCHMARK_INPUTS', 5))
+OUTPUTS = int(os.environ.get('BENCHMARK_OUTPUTS', 1))
+OPERATIONS = int(os.environ.get('BENCHMARK_OPERATIONS', 2))
+# Processes searched by output product, use 20000 for a full run
+DOMAIN_PROCESSES = int(os.environ.get('BENCHMARK_DOMAIN_PROCESSES', 500))
+# Products supplied, use 10000 for a full run
+PRODUCTS = int(os.environ.get('BENCHMARK_PRODUCTS', 100))
+# Productions scheduled, use 5000 for a full run
+SCHEDULE_PRODUCTIONS = int(
+    os.environ.get('BENCHMARK_SCHEDULE_PRODUCTIONS', 100))
+SCALE = int(os.environ.get('BENCHMARK_SCALE', 4))
+# Allowed growth of the lookup queries between the small and the large size
+QUERY_GROWTH = float(os.environ.get('BENCHMARK_QUERY_GROWTH', 2))
+# Allowed growth of the time per record between the small and the large size
+TIME_GROWTH = float(os.environ.get('BENCHMARK_TIME_GROWTH', 2))
+
+logger = logging.getLogger(__name__)
+
+
+def lookups(queries):
+    "Return the queries that are not inserting rows"
+    return [q for q in queries if not q.startswith('INSERT')]
+
+
+class ProductionProcessBenchmark(unittest.TestCase):
+    'Benchmark ProductionProcess module'
+    results = []
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        drop_db()
+        modules = ['production_process']
+        if stock_supply_production:
+            modules.append('stock_supply_production')
+        activate_module(modules)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        drop_db()
+        logger.info('%-40s %8s %10s %8s', 'benchmark', 'size', 'seconds',
+            'queries')
+        for name, size, elapsed, queries in cls.results:
+            logger.info('%-40s %8d %10.3f %8d', name, size, elapsed, queries)
+
+    @contextmanager
+    def setup_data(self):
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Location = pool.get('stock.location')
+        OperationType = pool.get('production.operation.type')
+        Category = pool.get('production.work_center.category')
+
+        self.company = create_company()
+        self.unit, = Uom.search([('name', '=', 'Unit')])
+        hour, = Uom.search([('name', '=', 'Hour')])
+        self.warehouse, = Location.search([('code', '=', 'WH')])
+        production_location, = Location.search([('code', '=', 'PROD')])
+        Location.write([self.warehouse], {
+                'production_location': production_location.id,
+                })
+        self.components = [create_product('Component %s' % i)
+            for i in range(INPUTS)]
+        self.products = [create_product('Product %s' % i, producible=True)
+            for i in range(OUTPUTS)]
+        operation_type, = OperationType.create([{'name': 'Benchmark'}])
+        category, = Category.create([{
+                    'name': 'Benchmark',
+                    'uom': hour.id,
+                    'cost_price': Decimal(1),
+                    }])
+        self.operation_values = {
+            'operation_type': operation_type.id,
+            'work_center_category': category.id,
+            'time': 1,
+            'quantity': 1,
+            'quantity_uom': self.unit.id,
+            'calculation': 'standard',
+            }
+        with set_company(self.company):
+            yield
+
+    def measure(self, name, size, func, *args, **kwargs):
+        "Run func and return its elapsed time and lookup queries"
+        with count_queries() as queries:
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+        self.results.append((name, size, elapsed, len(lookups(queries))))
+        return result, elapsed, len(lookups(queries))
+
+    def compare(self, name, func, size, queries=True):
+        "Run func with the small and large size and check the growth"
+        small, large = size, size * SCALE
+        _, small_time, small_queries = self.measure(
+            name, small, func, small)
+        _, large_time, large_queries = self.measure(
+            name, large, func, large)
+        if queries:
+            self.assertLessEqual(large_queries, small_queries * QUERY_GROWTH,
+                msg='%s lookup queries grow with the size' % name)
+        self.assertLessEqual(
+            large_time / large, small_time / small * TIME_GROWTH,
+            msg='%s time per record grows with the size' % name)
+
+    def process_values(self, name, steps=STEPS, products=None):
+        if products is None:
+            products = self.products
+        return {
+            'name': name,
+            'uom': self.unit.id,
+            'steps': [('create', [{
+                            'name': 'Step %s' % s,
+                            'sequence': s,
+                            'inputs': [('create', [{
+                                            'product': c.id,
+                                            'quantity': 1,
+                                            'unit': self.unit.id,
+                                            } for c in self.components])],
+                            'outputs': [('create', [{
+                                            'product': p.id,
+                                            'quantity': 1,
+                                            'unit': self.unit.id,
+                                            } for p in products
+                                        if s == steps - 1])],
+                            'operations': [('create', [
+                                        dict(self.operation_values,
+                                            sequence=o)
+                                        for o in range(OPERATIONS)])],
+                            } for s in range(steps)])],
+            }
+
+    def create_processes(self, count, steps=STEPS):
+        Process = Pool().get('production.process')
+        return Process.create([
+                self.process_values('Process %s' % i, steps=steps)
+                for i in range(count)])
+
+    def create_shortages(self, count):
+        "Return count producible products with a shortage in the warehouse"
+        pool = Pool()
+        Date = pool.get('ir.date')
+        Move = pool.get('stock.move')
+        Location = pool.get('stock.location')
+
+        storage, = Location.search([('code', '=', 'STO')])
+        customer, = Location.search([('code', '=', 'CUS')])
+        products = [create_product('Supplied %s' % i, producible=True)
+            for i in range(count)]
+        Move.create([{
+                    'product': p.id,
+                    'unit': self.unit.id,
+                    'quantity': 1,
+                    'from_location': storage.id,
+                    'to_location': customer.id,
+                    'planned_date': Date.today(),
+                    'company': self.company.id,
+                    'unit_price': Decimal(1),
+                    'currency': self.company.currency.id,
+                    } for p in products])
+        return products
+
+    def set_default_processes(self, products):
+        "Set to each product a default process with a step producing it"
+        pool = Pool()
+        Process = pool.get('production.process')
+        ProductBom = pool.get('product.product-production.bom')
+        processes = Process.create([
+                self.process_values(p.rec_name, steps=1, products=[p])
+                for p in products])
+        ProductBom.create([{
+                    'product': p.id,
+                    'process': process.id,
+                    } for p, process in zip(products, processes)])
+
+    def production(self, process, quantity=10):
+        Production = Pool().get('production')
+        production = Production()
+        production.company = self.company
+        production.warehouse = self.warehouse
+        production.location = self.warehouse.production_location
+        production.product = self.products[0]
+        production.unit = self.unit
+        production.quantity = quantity
+        production.process = process
+        return production
+
+    @with_transaction()
+    def test_process_create(self):
+        'Benchmark Process.create'
+        with self.setup_data():
+            self.compare('Process.create', self.create_processes, PROCESSES)
+
+    @with_transaction()
+    def test_process_copy(self):
+        'Benchmark Process.copy against copying process by process'
+        with self.setup_data():
+            Process = Pool().get('production.process')
+            processes = self.create_processes(PROCESSES * SCALE)
+
+            self.compare('Process.copy',
+                lambda size: Process.copy(processes[:size]), PROCESSES)
+
+            def copy_one_by_one(size):
+                for process in processes[:size]:
+                    Process.copy([process])
+            _, one_by_one, _ = self.measure('Process.copy one by one',
+                PROCESSES * SCALE, copy_one_by_one, PROCESSES * SCALE)
+            _, bulk, _ = self.measure('Process.copy',
+                PROCESSES * SCALE, Process.copy, processes)
+            self.assertLessEqual(bulk, one_by_one * TIME_GROWTH)
+
+    @with_transaction()
+    def test_export_import_lines(self):
+        'Benchmark Process.export_lines and Process.import_lines'
+        with self.setup_data():
+            pool = Pool()
+            Process = pool.get('production.process')
+            Template = pool.get('product.template')
+            for i, product in enumerate(self.components + self.products):
+                Template.write([product.template], {'code': 'P%s' % i})
+            processes = self.create_processes(PROCESSES * SCALE)
+
+            def export_import(size):
+                lines = Process.export_lines(processes[:size])
+                return Process.import_lines(lines)
+            self.compare('Process.export_lines/import_lines', export_import,
+                PROCESSES)
+
+    @with_transaction()
+    def test_check_consistency(self):
+        'Benchmark Process.get_inconsistencies'
+        with self.setup_data():
+            Process = Pool().get('production.process')
+
+            small = PROCESSES
+            self.create_processes(small)
+            _, small_time, _ = self.measure('Process.get_inconsistencies',
+                small, Process.get_inconsistencies)
+            self.create_processes(small * SCALE - small)
+            _, large_time, _ = self.measure('Process.get_inconsistencies',
+                small * SCALE, Process.get_inconsistencies)
+            self.assertLessEqual(
+                large_time / SCALE, small_time * TIME_GROWTH,
+                msg='Process.get_inconsistencies time per process grows '
+                'with the processes')
+
+    @with_transaction()
+    def test_step_copy(self):
+        'Benchmark Step.copy'
+        with self.setup_data():
+            Step = Pool().get('production.process.step')
+            process, = self.create_processes(1, steps=STEPS * SCALE)
+
+            self.compare('Step.copy',
+                lambda size: Step.copy(process.steps[:size]), STEPS)
+
+    @with_transaction()
+    def test_on_change_process(self):
+        'Benchmark Production.on_change_process'
+        with self.setup_data():
+            process, = self.create_processes(1, steps=STEPS * SCALE)
+
+            def on_change_process(size):
+                for _ in range(size):
+                    self.production(process).on_change_process()
+            self.compare('Production.on_change_process', on_change_process,
+                PROCESSES, queries=False)
+
+    @with_transaction()
+    def test_explode_bom(self):
+        'Benchmark Production.explode_bom with _move'
+        with self.setup_data():
+            process, = self.create_processes(1, steps=STEPS * SCALE)
+
+            def explode_bom(size):
+                for _ in range(size):
+                    production = self.production(None)
+                    production.bom = process.bom
+                    production.explode_bom()
+            self.compare('Production.explode_bom', explode_bom, PROCESSES,
+                queries=False)
+
+    @with_transaction()
+    def test_output_products_domain(self):
+        'Benchmark the output products domain against many processes'
+        with self.setup_data():
+            pool = Pool()
+            Process = pool.get('production.process')
+            BOMOutput = pool.get('production.bom.output')
+
+            product = create_product('Target', producible=True)
+            process, = self.create_processes(1, steps=1)
+            BOMOutput.create([{
+                        'step': process.steps[0].id,
+                        'product': product.id,
+                        'quantity': 1,
+                        'unit': self.unit.id,
+                        }])
+
+            def search(size):
+                for _ in range(PROCESSES):
+                    self.assertEqual(Process.search([
+                                ('output_products', '=', product.id),
+                                ]), [process])
+
+            small = DOMAIN_PROCESSES // SCALE
+            self.create_processes(small, steps=1)
+            _, small_time, _ = self.measure(
+                'Process output_products domain', small, search, small)
+            self.create_processes(DOMAIN_PROCESSES - small, steps=1)
+            _, large_time, _ = self.measure('Process output_products domain',
+                DOMAIN_PROCESSES, search, DOMAIN_PROCESSES)
+            self.assertLessEqual(large_time, small_time * TIME_GROWTH,
+                msg='output_products domain time grows with the processes')
+
+    @with_transaction()
+    def test_where_used(self):
+        'Benchmark Process.where_used against many processes'
+        with self.setup_data():
+            pool = Pool()
+            Process = pool.get('production.process')
+            BOMInput = pool.get('production.bom.input')
+
+            component = create_product('Used')
+            process, = self.create_processes(1, steps=1)
+            BOMInput.create([{
+                        'step': process.steps[0].id,
+                        'product': component.id,
+                        'quantity': 1,
+                        'unit': self.unit.id,
+                        }])
+
+            def where_used(size):
+                for _ in range(PROCESSES):
+                    self.assertEqual(
+                        Process.where_used([component])['processes'],
+                        [process.id])
+
+            small = DOMAIN_PROCESSES // SCALE
+            self.create_processes(small, steps=1)
+            _, small_time, _ = self.measure(
+                'Process.where_used', small, where_used, small)
+            self.create_processes(DOMAIN_PROCESSES - small, steps=1)
+            _, large_time, _ = self.measure('Process.where_used',
+                DOMAIN_PROCESSES, where_used, DOMAIN_PROCESSES)
+            self.assertLessEqual(large_time, small_time * TIME_GROWTH,
+                msg='where used time grows with the processes')
+
+    @with_transaction()
+    def test_schedule_steps(self):
+        'Benchmark Production.schedule_steps of many open productions'
+        with self.setup_data():
+            Production = Pool().get('production')
+            process, = self.create_processes(1)
+
+            productions = Production.create([{
+                        'company': self.company.id,
+                        'warehouse': self.warehouse.id,
+                        'location': self.warehouse.production_location.id,
+                        'product': self.products[0].id,
+                        'unit': self.unit.id,
+                        'quantity': 10,
+                        'process': process.id,
+                        } for _ in range(SCHEDULE_PRODUCTIONS * SCALE)])
+
+            def schedule_steps(size):
+                Production.schedule_steps(productions[:size])
+            self.compare('Production.schedule_steps', schedule_steps,
+                SCHEDULE_PRODUCTIONS, queries=False)
+
+    @with_transaction()
+    def test_apply_process(self):
+        'Benchmark Production.apply_process on many productions'
+        with self.setup_data():
+            Production = Pool().get('production')
+            process, = self.create_processes(1)
+
+            productions = Production.create([{
+                        'company': self.company.id,
+                        'warehouse': self.warehouse.id,
+                        'location': self.warehouse.production_location.id,
+                        'product': self.products[0].id,
+                        'unit': self.unit.id,
+                        'quantity': 10,
+                        } for _ in range(SCHEDULE_PRODUCTIONS * SCALE)])
+
+            def apply_process(size):
+                Production.apply_process(
+                    Production.browse(productions[:size]), process)
+            self.compare('Production.apply_process', apply_process,
+                SCHEDULE_PRODUCTIONS, queries=False)
+
+    @with_transaction()
+    def test_explode_requirements(self):
+        'Benchmark Process.explode_requirements across many products'
+        with self.setup_data():
+            pool = Pool()
+            Process = pool.get('production.process')
+            ProductBom = pool.get('product.product-production.bom')
+            BOMOutput = pool.get('production.bom.output')
+
+            process, = self.create_processes(1)
+            products = [create_product('Exploded %s' % i, producible=True)
+                for i in range(PRODUCTS * SCALE)]
+            BOMOutput.create([{
+                        'step': process.steps[-1].id,
+                        'product': p.id,
+                        'quantity': 1,
+                        'unit': self.unit.id,
+                        } for p in products])
+            ProductBom.create([{
+                        'product': p.id,
+                        'process': process.id,
+                        } for p in products])
+
+            def explode(size):
+                Process.explode_requirements(
+                    [(p, 1, self.unit) for p in products[:size]])
+            self.compare('Process.explode_requirements', explode, PRODUCTS)
+
+    @unittest.skipUnless(stock_supply_production,
+        'requires stock_supply_production')
+    @with_transaction()
+    def test_compute_request(self):
+        'Benchmark Production.compute_request for many products'
+        with self.setup_data():
+            pool = Pool()
+            Date = pool.get('ir.date')
+            Production = pool.get('production')
+
+            products = [create_product('Supplied %s' % i, producible=True)
+                for i in range(PRODUCTS * SCALE)]
+            self.set_default_processes(products)
+            today = Date.today()
+
+            def compute_requests(size, batch=True):
+                with Transaction().set_context(_request_process=not batch):
+                    requests = [Production.compute_request(
+                            p, self.warehouse, 1, today, self.company)
+                        for p in products[:size]]
+                Production.save(requests)
+                if batch:
+                    Production.set_request_process(requests)
+            self.compare('Production.compute_request', compute_requests,
+                PRODUCTS, queries=False)
+            _, per_product, _ = self.measure(
+                'Production.compute_request per product', PRODUCTS * SCALE,
+                compute_requests, PRODUCTS * SCALE, batch=False)
+            _, batch, _ = self.measure(
+                'Production.compute_request batch', PRODUCTS * SCALE,
+                compute_requests, PRODUCTS * SCALE)
+            self.assertLessEqual(batch, per_product * TIME_GROWTH)
+
+    @unittest.skipUnless(stock_supply_production,
+        'requires stock_supply_production')
+    @with_transaction()
+    def test_generate_requests(self):
+        'Benchmark the supply run with the processes set per product or batch'
+        with self.setup_data():
+            pool = Pool()
+            Production = pool.get('production')
+
+            self.set_default_processes(self.create_shortages(PRODUCTS))
+            compute_request = Production.compute_request
+
+            def compute_request_per_product(*args, **kwargs):
+                with Transaction().set_context(_request_process=True):
+                    return compute_request(*args, **kwargs)
+
+            def generate_requests_per_product():
+                # The supply run as it was before set_request_process
+                with patch.object(Production, 'compute_request',
+                        compute_request_per_product), \
+                        patch.object(Production, 'set_request_process',
+                            lambda productions: None):
+                    return Production.generate_requests()
+
+            def supplied():
+                return sorted((r.product.id, r.process.id)
+                    for r in Production.search([('state', '=', 'request')]))
+
+            _, per_product, _ = self.measure(
+                'Production.generate_requests per product', PRODUCTS,
+                generate_requests_per_product)
+            before = supplied()
+            self.assertEqual(len(before), PRODUCTS)
+            self.assertTrue(all(process for _, process in before))
+            _, batch, _ = self.measure(
+                'Production.generate_requests batch', PRODUCTS,
+                Production.generate_requests)
+            self.assertEqual(supplied(), before)
+            self.assertLessEqual(batch, per_product * TIME_GROWTH)
+
+    @unittest.skipUnless(stock_supply_production,
+        'requires stock_supply_production')
+    @with_transaction()
+    def test_generate_requests_parallel(self):
+        'Benchmark Production.generate_requests against its partitions'
+        with self.setup_data():
+            pool = Pool()
+            Production = pool.get('production')
+
+            # The components are not in the partitions of the products
+            self.set_default_processes(self.create_shortages(PRODUCTS))
+
+            def supplied():
+                return sorted(
+                    (r.product.id, r.quantity,
+                        sorted((m.product.id, m.quantity) for m in r.inputs))
+                    for r in Production.search([('state', '=', 'request')]))
+
+            self.measure('Production.generate_requests', PRODUCTS,
+                Production.generate_requests)
+            serial = supplied()
+            self.assertEqual(len(serial), PRODUCTS)
+
+            def generate_requests_parallel():
+                with Transaction().set_context(supply_partitions=SCALE):
+                    Production.generate_requests()
+                # Run the queued partitions as the workers would
+                run_queue()
+            self.measure('Production.generate_requests %s partitions' % SCALE,
+                PRODUCTS, generate_requests_parallel)
+            self.assertEqual(supplied(), serial)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,1220 @@
-
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import datetime
+from decimal import Decimal
+from unittest.mock import patch
+
+from trytond.exceptions import UserError
+from trytond.modules.company.tests import (
+    CompanyTestMixin, create_company, set_company)
+from trytond.modules.production_process.instrumentation import (
+    get_statistics)
+from trytond.modules.production_process.scheduler import schedule
+from trytond.pool import Pool
+from trytond.tests.test_tryton import ModuleTestCase, with_transaction
+from trytond.transaction import Transaction
 
-from trytond.modules.company.tests import CompanyTestMixin
-from trytond.tests.test_tryton import ModuleTestCase
+from .tools import (
+    count_queries, create_process, create_product, index_usable, query_plan,
+    run_queue)
 
 
 class ProductionProcessTestCase(CompanyTestMixin, ModuleTestCase):
     'Test ProductionProcess module'
     module = 'production_process'
+    extras = ['stock_supply_production']
+
+    @with_transaction()
+    def test_create_step_lines_constant_lookups(self):
+        'Test step lines resolve their BOM with a constant number of queries'
+        pool = Pool()
+        BOMInput = pool.get('production.bom.input')
+
+        component = create_product('Component')
+        process = create_process('Process', steps=20)
+
+        counts = []
+        for size in (1, 20):
+            with count_queries('production_process_step') as queries:
+                inputs = BOMInput.create([{
+                            'step': step.id,
+                            'product': component.id,
+                            'quantity': 1,
+                            'unit': component.default_uom.id,
+                            } for step in process.steps[:size]])
+            counts.append(len(queries))
+            self.assertTrue(all(i.bom == process.bom for i in inputs))
+        self.assertEqual(counts[0], counts[1])
+
+    @with_transaction()
+    def test_key_lookups_index_usable(self):
+        'Test the lookups on the process foreign keys have a usable index'
+        pool = Pool()
+        Process = pool.get('production.process')
+        Step = pool.get('production.process.step')
+        BOMInput = pool.get('production.bom.input')
+        BOMOutput = pool.get('production.bom.output')
+        Operation = pool.get('production.route.operation')
+        Move = pool.get('stock.move')
+        Production = pool.get('production')
+        ProductBom = pool.get('product.product-production.bom')
+
+        components = [create_product('Component %s' % i) for i in range(5)]
+        processes = [create_process('Process %s' % i, steps=10)
+            for i in range(20)]
+        BOMInput.create([{
+                    'step': step.id,
+                    'product': component.id,
+                    'quantity': 1,
+                    'unit': component.default_uom.id,
+                    'step_sequence': i,
+                    } for process in processes for step in process.steps
+                for i, component in enumerate(components)])
+        process = processes[10]
+        step = process.steps[5]
+
+        process_table = Process.__table__()
+        step_table = Step.__table__()
+        input_table = BOMInput.__table__()
+        output_table = BOMOutput.__table__()
+        operation_table = Operation.__table__()
+        move_table = Move.__table__()
+        production_table = Production.__table__()
+        product_bom_table = ProductBom.__table__()
+        queries = {
+            'step inputs': input_table.select(input_table.id,
+                where=input_table.step == step.id,
+                order_by=[input_table.step_sequence]),
+            'step outputs': output_table.select(output_table.id,
+                where=output_table.step == step.id,
+                order_by=[output_table.step_sequence]),
+            'step operations': operation_table.select(operation_table.id,
+                where=operation_table.step == step.id,
+                order_by=[operation_table.sequence]),
+            'component inputs': input_table.select(input_table.bom,
+                where=input_table.product == components[0].id),
+            'step moves': move_table.select(move_table.id,
+                where=move_table.production_step == step.id),
+            'process steps': step_table.select(step_table.id,
+                where=step_table.process == process.id,
+                order_by=[step_table.sequence]),
+            'bom process': process_table.select(process_table.id,
+                where=process_table.bom == process.bom.id),
+            'route process': process_table.select(process_table.id,
+                where=process_table.route == process.route.id),
+            'process productions': production_table.select(
+                production_table.id,
+                where=production_table.process == process.id),
+            'process product boms': product_bom_table.select(
+                product_bom_table.id,
+                where=product_bom_table.process == process.id),
+            }
+        for name, query in queries.items():
+            with self.subTest(lookup=name):
+                self.assertTrue(index_usable(query),
+                    msg='\n'.join(query_plan(query)))
+
+    @with_transaction()
+    def test_bom_route_cache(self):
+        'Test process BOM, route and UoM are cached until modified'
+        pool = Pool()
+        Process = pool.get('production.process')
+        Step = pool.get('production.process.step')
+        Uom = pool.get('product.uom')
+
+        kilogram, = Uom.search([('name', '=', 'Kilogram')])
+        process = create_process('Process')
+        step, = process.steps
+
+        self.assertEqual(Process.get_bom_route_uom([process.id]), {
+                process.id: (
+                    process.bom.id, process.route.id, process.uom.id),
+                })
+        with count_queries('production_process') as queries:
+            self.assertEqual(Process.get_bom_route([process.id]), {
+                    process.id: (process.bom.id, process.route.id),
+                    })
+            self.assertEqual(Step.get_bom_route([step.id]), {
+                    step.id: (process.bom.id, process.route.id),
+                    })
+        self.assertEqual(queries, [])
+
+        Process.write([process], {'uom': kilogram.id})
+        _, _, uom = Process.get_bom_route_uom([process.id])[process.id]
+        self.assertEqual(uom, kilogram.id)
+
+    @with_transaction()
+    def test_bom_input_steps(self):
+        'Test BOM product to step mapping and its invalidation'
+        pool = Pool()
+        BOMInput = pool.get('production.bom.input')
+
+        component1 = create_product('Component 1')
+        component2 = create_product('Component 2')
+        process = create_process('Process', steps=2)
+        step1, step2 = process.steps
+        input1, input2 = BOMInput.create([{
+                    'step': step.id,
+                    'product': component.id,
+                    'quantity': 1,
+                    'unit': component.default_uom.id,
+                    } for step, component in [
+                    (step1, component1), (step2, component2)]])
+
+        self.assertEqual(process.bom.get_input_steps(), {
+                component1.id: step1.id,
+                component2.id: step2.id,
+                })
+
+        BOMInput.write([input2], {'step': step1.id})
+        self.assertEqual(process.bom.get_input_steps(), {
+                component1.id: step1.id,
+                component2.id: step1.id,
+                })
+
+        BOMInput.delete([input1])
+        self.assertEqual(process.bom.get_input_steps(), {
+                component2.id: step1.id,
+                })
+
+    @with_transaction()
+    def test_output_products(self):
+        'Test output products are kept in sync with the BOM outputs'
+        pool = Pool()
+        Process = pool.get('production.process')
+        BOMOutput = pool.get('production.bom.output')
+
+        product1 = create_product('Product 1', producible=True)
+        product2 = create_product('Product 2', producible=True)
+        process = create_process('Process')
+        step, = process.steps
+        output, = BOMOutput.create([{
+                    'step': step.id,
+                    'product': product1.id,
+                    'quantity': 1,
+                    'unit': product1.default_uom.id,
+                    }])
+
+        self.assertEqual(list(process.output_products), [product1])
+        self.assertEqual(
+            Process.search([('output_products', '=', product1.id)]),
+            [process])
+
+        BOMOutput.write([output], {'product': product2.id})
+        self.assertEqual(
+            Process.search([('output_products', '=', product1.id)]), [])
+        self.assertEqual(
+            Process.search([('output_products', '=', product2.id)]),
+            [process])
+
+        BOMOutput.delete([output])
+        self.assertEqual(
+            Process.search([('output_products', '=', product2.id)]), [])
+
+    @with_transaction()
+    def test_output_products_phantom(self):
+        'Test phantom outputs are not output products'
+        pool = Pool()
+        Process = pool.get('production.process')
+        BOM = pool.get('production.bom')
+        BOMOutput = pool.get('production.bom.output')
+
+        product = create_product('Product', producible=True)
+        unit = product.default_uom
+        phantom, = BOM.create([{
+                    'name': 'Phantom',
+                    'phantom': True,
+                    'phantom_unit': unit.id,
+                    'phantom_quantity': 1,
+                    'outputs': [('create', [{
+                                    'product': product.id,
+                                    'quantity': 1,
+                                    'unit': unit.id,
+                                    }])],
+                    }])
+        process = create_process('Process')
+        step, = process.steps
+        BOMOutput.create([{
+                    'step': step.id,
+                    'phantom_bom': phantom.id,
+                    'quantity': 1,
+                    'unit': unit.id,
+                    }, {
+                    'step': step.id,
+                    'product': product.id,
+                    'quantity': 1,
+                    'unit': unit.id,
+                    }])
+
+        self.assertEqual(
+            Process.search([('output_products', '=', product.id)]),
+            [process])
+        self.assertEqual(list(Process(process.id).output_products), [product])
+
+    @with_transaction()
+    def test_process_lines_constant_queries(self):
+        'Test process lines are read with a constant number of queries'
+        pool = Pool()
+        Process = pool.get('production.process')
+        BOMInput = pool.get('production.bom.input')
+
+        component = create_product('Component')
+        processes = [create_process('Process %s' % i) for i in range(10)]
+        BOMInput.create([{
+                    'step': p.steps[0].id,
+                    'product': component.id,
+                    'quantity': 1,
+                    'unit': component.default_uom.id,
+                    } for p in processes])
+
+        counts = []
+        for size in (1, 10):
+            with count_queries('production_bom_input') as queries:
+                values = Process.read(
+                    [p.id for p in processes[:size]], ['inputs'])
+            counts.append(len(queries))
+            for process, value in zip(processes, values):
+                self.assertEqual(
+                    value['inputs'], [i.id for i in process.bom.inputs])
+        self.assertEqual(counts[0], counts[1])
+
+    @with_transaction()
+    def test_copy_process_constant_creates(self):
+        'Test copying processes creates steps and lines in bulk'
+        pool = Pool()
+        Process = pool.get('production.process')
+        Step = pool.get('production.process.step')
+        BOMInput = pool.get('production.bom.input')
+
+        component = create_product('Component')
+        processes = [create_process('Process %s' % i, steps=3)
+            for i in range(3)]
+        BOMInput.create([{
+                    'step': s.id,
+                    'product': component.id,
+                    'quantity': 1,
+                    'unit': component.default_uom.id,
+                    } for p in processes for s in p.steps])
+
+        counts = []
+        for size in (1, 3):
+            with patch.object(Step, 'create', wraps=Step.create) as create:
+                copies = Process.copy(processes[:size])
+            counts.append(create.call_count)
+            for process, copy in zip(processes, copies):
+                self.assertEqual(copy.name, '%s (*)' % process.name)
+                self.assertNotEqual(copy.bom, process.bom)
+                self.assertNotEqual(copy.route, process.route)
+                self.assertEqual(
+                    [s.name for s in copy.steps],
+                    [s.name for s in process.steps])
+                for step in copy.steps:
+                    input_, = step.inputs
+                    self.assertEqual(input_.bom, copy.bom)
+        self.assertEqual(counts[0], counts[1])
+
+    @with_transaction()
+    def test_copy_process_twice(self):
+        'Test copying the same process twice gives each copy its steps'
+        pool = Pool()
+        Process = pool.get('production.process')
+        BOMInput = pool.get('production.bom.input')
+
+        component = create_product('Component')
+        process = create_process('Process', steps=2)
+        BOMInput.create([{
+                    'step': s.id,
+                    'product': component.id,
+                    'quantity': 1,
+                    'unit': component.default_uom.id,
+                    } for s in process.steps])
+
+        copies = Process.copy([process, process])
+        self.assertEqual(len(copies), 2)
+        for copy in copies:
+            self.assertEqual(len(copy.steps), 2)
+            for step in copy.steps:
+                input_, = step.inputs
+                self.assertEqual(input_.bom, copy.bom)
+        self.assertEqual(len(copies[0].bom.inputs), 2)
+        self.assertEqual(len(copies[1].bom.inputs), 2)
+
+    @with_transaction()
+    def test_rename_process_grouped_writes(self):
+        'Test renaming processes writes BOMs and routes once per name'
+        pool = Pool()
+        Process = pool.get('production.process')
+        BOM = pool.get('production.bom')
+        Route = pool.get('production.route')
+
+        processes = [create_process('Process %s' % i) for i in range(10)]
+
+        with patch.object(BOM, 'write', wraps=BOM.write) as bom_write, \
+                patch.object(Route, 'write', wraps=Route.write) as route_write:
+            Process.write(processes[:5], {'name': 'Renamed'},
+                processes[5:], {'name': 'Other'})
+
+        self.assertEqual(bom_write.call_count, 1)
+        self.assertEqual(len(bom_write.call_args[0]), 4)
+        self.assertEqual(route_write.call_count, 1)
+        self.assertEqual(len(route_write.call_args[0]), 4)
+        for process in processes[:5]:
+            self.assertEqual(process.bom.name, 'Renamed')
+            self.assertEqual(process.route.name, 'Renamed')
+        for process in processes[5:]:
+            self.assertEqual(process.bom.name, 'Other')
+            self.assertEqual(process.route.name, 'Other')
+
+    @with_transaction()
+    def test_check_consistency(self):
+        'Test the inconsistencies of the process trees are all found'
+        pool = Pool()
+        Process = pool.get('production.process')
+        Step = pool.get('production.process.step')
+        BOMInput = pool.get('production.bom.input')
+        Operation = pool.get('production.route.operation')
+        OperationType = pool.get('production.operation.type')
+
+        component = create_product('Component')
+        process = create_process('Process')
+        other = create_process('Other')
+        step, = process.steps
+        operation_type, = OperationType.create([{'name': 'Operation'}])
+        input_, = BOMInput.create([{
+                    'step': step.id,
+                    'product': component.id,
+                    'quantity': 1,
+                    'unit': component.default_uom.id,
+                    }])
+        operation, = Operation.create([{
+                    'step': step.id,
+                    'operation_type': operation_type.id,
+                    'time': 1,
+                    'calculation': 'fixed',
+                    }])
+        self.assertEqual(Process.get_inconsistencies(), [])
+
+        BOMInput.write([input_], {'bom': other.bom.id})
+        Operation.write([operation], {'route': other.route.id})
+        orphan, = Step.create([{'name': 'Orphan'}])
+        dangling, = BOMInput.create([{
+                    'bom': process.bom.id,
+                    'product': component.id,
+                    'quantity': 1,
+                    'unit': component.default_uom.id,
+                    'step_sequence': 3,
+                    }])
+        inconsistencies = [
+            ('bom', 'production.bom.input', input_.id),
+            ('orphan', 'production.process.step', orphan.id),
+            ('route', 'production.route.operation', operation.id),
+            ('sequence', 'production.bom.input', dangling.id),
+            ]
+        self.assertEqual(Process.get_inconsistencies(), inconsistencies)
+        with self.assertLogs(
+                'trytond.modules.production_process.production', 'WARNING'):
+            self.assertEqual(Process.check_consistency(), inconsistencies)
+
+        BOMInput.write([input_], {'bom': process.bom.id})
+        Operation.write([operation], {'route': process.route.id})
+        Step.delete([orphan, step])
+        BOMInput.delete([dangling])
+        self.assertEqual(Process.get_inconsistencies(), [])
+
+    @with_transaction()
+    def test_delete_bom_route_used(self):
+        'Test deleting BOMs and routes used by processes reports all of them'
+        pool = Pool()
+        Process = pool.get('production.process')
+        BOM = pool.get('production.bom')
+        Route = pool.get('production.route')
+
+        process1 = create_process('Process 1')
+        process2 = create_process('Process 2')
+
+        with self.assertRaises(UserError) as cm:
+            BOM.delete([process1.bom, process2.bom])
+        self.assertIn('Process 1', cm.exception.message)
+        self.assertIn('Process 2', cm.exception.message)
+        with self.assertRaises(UserError) as cm:
+            Route.delete([process1.route, process2.route])
+        self.assertIn('Process 1', cm.exception.message)
+        self.assertIn('Process 2', cm.exception.message)
+
+        bom, route = process1.bom, process1.route
+        Process.delete([process1, process2])
+        self.assertEqual(BOM.search([('id', '=', bom.id)]), [])
+        self.assertEqual(Route.search([('id', '=', route.id)]), [])
+
+    @with_transaction()
+    def test_default_processes(self):
+        'Test default process of products is the one of their first BOM'
+        pool = Pool()
+        ProductBom = pool.get('product.product-production.bom')
+
+        product1 = create_product('Product 1', producible=True)
+        product2 = create_product('Product 2', producible=True)
+        process1 = create_process('Process 1')
+        process2 = create_process('Process 2')
+        ProductBom.create([{
+                    'product': product1.id,
+                    'process': process1.id,
+                    'sequence': 20,
+                    }, {
+                    'product': product1.id,
+                    'process': process2.id,
+                    'sequence': 10,
+                    }, {
+                    'product': product2.id,
+                    'process': process1.id,
+                    }])
+
+        self.assertEqual(
+            ProductBom.get_default_processes([product1.id, product2.id]), {
+                product1.id: process2.id,
+                product2.id: process1.id,
+                })
+
+    @with_transaction()
+    def test_process_plan(self):
+        'Test process plan is cached and invalidated on changes'
+        pool = Pool()
+        BOMInput = pool.get('production.bom.input')
+
+        component = create_product('Component')
+        process = create_process('Process', steps=2)
+        step1, step2 = process.steps
+        input_, = BOMInput.create([{
+                    'step': step1.id,
+                    'product': component.id,
+                    'quantity': 2,
+                    'unit': component.default_uom.id,
+                    }])
+
+        plan = process.get_plan()
+        self.assertEqual(plan['bom'], process.bom.id)
+        self.assertEqual(plan['route'], process.route.id)
+        self.assertEqual([s['id'] for s in plan['steps']],
+            [step1.id, step2.id])
+        plan_input, = plan['inputs']
+        self.assertEqual(plan_input['product'], component.id)
+        self.assertEqual(plan_input['quantity'], 2)
+        self.assertEqual(plan_input['step'], step1.id)
+        self.assertEqual(plan['outputs'], ())
+        with count_queries() as queries:
+            self.assertEqual(process.get_plan(), plan)
+        self.assertEqual(queries, [])
+
+        BOMInput.write([input_], {'quantity': 3, 'step': step2.id})
+        plan_input, = process.get_plan()['inputs']
+        self.assertEqual(plan_input['quantity'], 3)
+        self.assertEqual(plan_input['step'], step2.id)
+
+    @with_transaction()
+    def test_process_preview(self):
+        'Test process preview is scaled from the cached plan'
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        BOMInput = pool.get('production.bom.input')
+        BOMOutput = pool.get('production.bom.output')
+        Operation = pool.get('production.route.operation')
+        OperationType = pool.get('production.operation.type')
+        Category = pool.get('production.work_center.category')
+
+        hour, = Uom.search([('name', '=', 'Hour')])
+        component = create_product('Component')
+        product = create_product('Product', producible=True)
+        by_product = create_product('By-product', producible=True)
+        unit = product.default_uom
+        process = create_process('Process', steps=2)
+        step1, step2 = process.steps
+        operation_type, = OperationType.create([{'name': 'Operation'}])
+        category, = Category.create([{
+                    'name': 'Category',
+                    'uom': hour.id,
+                    }])
+        input_, = BOMInput.create([{
+                    'step': step1.id,
+                    'product': component.id,
+                    'quantity': 2,
+                    'unit': unit.id,
+                    }])
+        BOMOutput.create([{
+                    'step': step2.id,
+                    'product': product.id,
+                    'quantity': 1,
+                    'unit': unit.id,
+                    }, {
+                    'step': step2.id,
+                    'product': by_product.id,
+                    'quantity': 1,
+                    'unit': unit.id,
+                    }])
+        operation, = Operation.create([{
+                    'step': step2.id,
+                    'operation_type': operation_type.id,
+                    'work_center_category': category.id,
+                    'time': 2,
+                    'quantity': 1,
+                    'quantity_uom': unit.id,
+                    'calculation': 'standard',
+                    }])
+
+        preview = process.preview(product.id, 5, unit.id)
+        self.assertEqual(preview, [{
+                    'id': step1.id,
+                    'name': step1.name,
+                    'inputs': [{
+                            'product': component.id,
+                            'quantity': 10,
+                            'unit': unit.id,
+                            }],
+                    'outputs': [],
+                    'operations': [],
+                    }, {
+                    'id': step2.id,
+                    'name': step2.name,
+                    'inputs': [],
+                    'outputs': [{
+                            'product': product.id,
+                            'quantity': 5,
+                            'unit': unit.id,
+                            }, {
+                            'product': by_product.id,
+                            'quantity': 5,
+                            'unit': unit.id,
+                            }],
+                    'operations': [{
+                            'operation': operation.id,
+                            'resource': 'production.work_center.category,%s'
+                            % category.id,
+                            'hours': 10,
+                            }],
+                    }])
+        with count_queries('production_bom_input') as queries:
+            self.assertEqual(process.preview(product.id, 5, unit.id), preview)
+        self.assertEqual(queries, [])
+
+        BOMInput.write([input_], {'quantity': 3})
+        step_preview, _ = process.preview(product.id, 5, unit.id)
+        self.assertEqual(step_preview['inputs'][0]['quantity'], 15)
+
+        self.assertIsNone(process.preview(component.id, 5, unit.id))
+
+    @with_transaction()
+    def test_step_sequence(self):
+        'Test BOM lines are appended to their step and follow its order'
+        pool = Pool()
+        BOMInput = pool.get('production.bom.input')
+        Step = pool.get('production.process.step')
+
+        component = create_product('Component')
+        process = create_process('Process', steps=2)
+        step1, step2 = process.steps
+        inputs = BOMInput.create([{
+                    'step': step.id,
+                    'product': component.id,
+                    'quantity': 1,
+                    'unit': component.default_uom.id,
+                    } for step in [step2, step1, step1, step2]])
+        input1, input2, input3, input4 = BOMInput.browse(inputs)
+
+        self.assertEqual([i.step_sequence for i in BOMInput.browse(inputs)],
+            [1, 1, 2, 2])
+        self.assertEqual([i['id'] for i in process.get_plan()['inputs']],
+            [input2.id, input3.id, input1.id, input4.id])
+
+        BOMInput.write([input2], {'step': step2.id})
+        input2, = BOMInput.browse([input2])
+        self.assertEqual(input2.step_sequence, 3)
+
+        Step.write([step1], {'sequence': 3})
+        self.assertEqual([i['id'] for i in process.get_plan()['inputs']],
+            [input1.id, input4.id, input2.id, input3.id])
+
+    @with_transaction()
+    def test_compute_factor_several_steps(self):
+        'Test compute factor of a product output by several steps'
+        pool = Pool()
+        BOMOutput = pool.get('production.bom.output')
+
+        product = create_product('Product', producible=True)
+        other = create_product('Other', producible=True)
+        process = create_process('Process', steps=2)
+        BOMOutput.create([{
+                    'step': step.id,
+                    'product': product.id,
+                    'quantity': quantity,
+                    'unit': product.default_uom.id,
+                    } for step, quantity in zip(process.steps, [2, 3])])
+
+        self.assertEqual(
+            process.compute_factor(product, 10, product.default_uom), 2)
+        self.assertEqual(
+            process.get_plan()['factors']['outputs'][product.id]['steps'],
+            tuple(s.id for s in process.steps))
+        self.assertIsNone(
+            process.compute_factor(other, 10, other.default_uom))
+
+    @with_transaction()
+    def test_process_costs(self):
+        'Test step and process costs are recomputed on changes'
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Process = pool.get('production.process')
+        Product = pool.get('product.product')
+        BOMInput = pool.get('production.bom.input')
+        Operation = pool.get('production.route.operation')
+        OperationType = pool.get('production.operation.type')
+        Category = pool.get('production.work_center.category')
+        WorkCenter = pool.get('production.work_center')
+        Queue = pool.get('ir.queue')
+
+        company = create_company()
+        other_company = create_company('Other', currency=company.currency)
+        hour, = Uom.search([('name', '=', 'Hour')])
+        component = create_product('Component')
+        process = create_process('Process', steps=2)
+        step1, step2 = process.steps
+        operation_type, = OperationType.create([{'name': 'Operation'}])
+        category, = Category.create([{
+                    'name': 'Category',
+                    'uom': hour.id,
+                    'cost_price': Decimal(10),
+                    }])
+        work_center, = WorkCenter.create([{
+                    'name': 'Work Center',
+                    'category': category.id,
+                    'type': 'machine',
+                    'cost_price': Decimal(25),
+                    }])
+        with set_company(company):
+            Product.write([component], {'cost_price': Decimal(5)})
+            BOMInput.create([{
+                        'step': step1.id,
+                        'product': component.id,
+                        'quantity': 2,
+                        'unit': component.default_uom.id,
+                        }])
+            operation, = Operation.create([{
+                        'step': step2.id,
+                        'operation_type': operation_type.id,
+                        'work_center_category': category.id,
+                        'work_center': work_center.id,
+                        'time': 2,
+                        'calculation': 'fixed',
+                        }])
+            run_queue()
+            self.assertEqual(
+                [s.cost for s in Process(process.id).steps],
+                [Decimal(10), Decimal(50)])
+            self.assertEqual(Process(process.id).cost, Decimal(60))
+
+            Product.write([component], {'cost_price': Decimal(7)})
+            task, = Queue.browse(Transaction().tasks)
+            self.assertEqual(task.data['args'], [[company.id]])
+            run_queue()
+            self.assertEqual(Process(process.id).cost, Decimal(64))
+
+            Operation.write([operation], {'work_center': None})
+            run_queue()
+            self.assertEqual(Process(process.id).cost, Decimal(34))
+
+            copy, = Process.copy([process])
+            run_queue()
+            self.assertEqual(Process(copy.id).cost, Decimal(34))
+
+            Process.update_costs()
+            self.assertEqual(Process(process.id).cost, Decimal(34))
+        with set_company(other_company):
+            self.assertEqual(Process(process.id).cost, Decimal(20))
+
+    @with_transaction()
+    def test_export_import_lines(self):
+        'Test processes are exported and imported as JSON lines'
+        pool = Pool()
+        Process = pool.get('production.process')
+        Template = pool.get('product.template')
+        BOM = pool.get('production.bom')
+        BOMInput = pool.get('production.bom.input')
+        BOMOutput = pool.get('production.bom.output')
+        Operation = pool.get('production.route.operation')
+        OperationType = pool.get('production.operation.type')
+
+        component = create_product('Component')
+        product = create_product('Product', producible=True)
+        unit = component.default_uom
+        Template.write([component.template], {'code': 'COMP'})
+        Template.write([product.template], {'code': 'PROD'})
+        phantom, = BOM.create([{
+                    'name': 'Phantom',
+                    'phantom': True,
+                    'phantom_unit': unit.id,
+                    'phantom_quantity': 1,
+                    'inputs': [('create', [{
+                                    'product': component.id,
+                                    'quantity': 1,
+                                    'unit': unit.id,
+                                    }])],
+                    }])
+        process = create_process('Process', steps=2)
+        step1, step2 = process.steps
+        operation_type, = OperationType.create([{'name': 'Operation'}])
+        BOMInput.create([{
+                    'step': step1.id,
+                    'product': component.id,
+                    'quantity': 2,
+                    'unit': unit.id,
+                    }, {
+                    'step': step1.id,
+                    'phantom_bom': phantom.id,
+                    'quantity': 1,
+                    'unit': unit.id,
+                    }, {
+                    'bom': process.bom.id,
+                    'product': component.id,
+                    'quantity': 3,
+                    'unit': unit.id,
+                    }])
+        BOMOutput.create([{
+                    'step': step2.id,
+                    'product': product.id,
+                    'quantity': 1,
+                    'unit': product.default_uom.id,
+                    }])
+        Operation.create([{
+                    'step': step2.id,
+                    'operation_type': operation_type.id,
+                    'time': 1,
+                    'calculation': 'fixed',
+                    }])
+
+        lines = list(Process.export_lines([process]))
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(Process.import_lines(iter(lines)), 1)
+        imported, = Process.search([
+                ('id', '!=', process.id),
+                ])
+        self.assertNotEqual(imported.bom, process.bom)
+        self.assertEqual(len(imported.inputs), 3)
+        self.assertEqual(list(Process.export_lines([imported])), lines)
+
+        Template.write([component.template], {'code': 'OTHER'})
+        with self.assertRaises(UserError):
+            Process.import_lines(lines)
+
+        Template.write([component.template], {'code': 'COMP'})
+        duplicate = create_product('Duplicate')
+        Template.write([duplicate.template], {'code': 'PROD'})
+        with self.assertRaises(UserError):
+            Process.import_lines(lines)
+
+        Template.write([component.template], {'code': None})
+        with self.assertRaises(UserError):
+            list(Process.export_lines([process]))
+
+    @with_transaction()
+    def test_explode_requirements(self):
+        'Test requirements are exploded through the processes of the inputs'
+        pool = Pool()
+        BOMInput = pool.get('production.bom.input')
+        BOMOutput = pool.get('production.bom.output')
+        ProductBom = pool.get('product.product-production.bom')
+        Process = pool.get('production.process')
+
+        product = create_product('Product', producible=True)
+        component = create_product('Component', producible=True)
+        material = create_product('Material')
+        unit = product.default_uom
+        process1 = create_process('Process 1')
+        process2 = create_process('Process 2')
+        step1, = process1.steps
+        step2, = process2.steps
+        BOMInput.create([{
+                    'step': step.id,
+                    'product': input_.id,
+                    'quantity': quantity,
+                    'unit': unit.id,
+                    } for step, input_, quantity in [
+                    (step1, component, 2), (step2, material, 3)]])
+        BOMOutput.create([{
+                    'step': step.id,
+                    'product': output.id,
+                    'quantity': 1,
+                    'unit': unit.id,
+                    } for step, output in [
+                    (step1, product), (step2, component)]])
+        ProductBom.create([{
+                    'product': output.id,
+                    'process': process.id,
+                    } for output, process in [
+                    (product, process1), (component, process2)]])
+
+        result = Process.explode_requirements([(product, 5, unit)])
+        self.assertEqual(
+            {p: (v['gross'], v['net'], v['process'], v['level'])
+                for p, v in result['products'].items()}, {
+                product.id: (5, 5, process1.id, 0),
+                component.id: (10, 10, process2.id, 1),
+                material.id: (30, 30, None, 2),
+                })
+        self.assertEqual(
+            {k: (v['gross'], v['net']) for k, v in result['steps'].items()}, {
+                (step1.id, component.id): (10, 10),
+                (step2.id, material.id): (30, 30),
+                })
+
+        BOMInput.create([{
+                    'step': step2.id,
+                    'product': product.id,
+                    'quantity': 1,
+                    'unit': unit.id,
+                    }])
+        with self.assertRaises(UserError):
+            Process.explode_requirements([(product, 5, unit)])
+
+    @with_transaction()
+    def test_where_used(self):
+        'Test where used follows the outputs of the processes'
+        pool = Pool()
+        Location = pool.get('stock.location')
+        Process = pool.get('production.process')
+        Production = pool.get('production')
+        BOMInput = pool.get('production.bom.input')
+        BOMOutput = pool.get('production.bom.output')
+
+        company = create_company()
+        component = create_product('Component')
+        other = create_product('Other')
+        intermediate = create_product('Intermediate', producible=True)
+        product = create_product('Product', producible=True)
+        processes = []
+        for consumed, produced in [
+                (component, intermediate),
+                (intermediate, product),
+                (other, product),
+                ]:
+            process = create_process(produced.rec_name)
+            step, = process.steps
+            BOMInput.create([{
+                        'step': step.id,
+                        'product': consumed.id,
+                        'quantity': 1,
+                        'unit': consumed.default_uom.id,
+                        }])
+            BOMOutput.create([{
+                        'step': step.id,
+                        'product': produced.id,
+                        'quantity': 1,
+                        'unit': produced.default_uom.id,
+                        }])
+            processes.append(process)
+        process1, process2, _ = processes
+        warehouse, = Location.search([('code', '=', 'WH')])
+        with set_company(company):
+            production, cancelled = Production.create([{
+                        'company': company.id,
+                        'warehouse': warehouse.id,
+                        'location': warehouse.production_location.id,
+                        'product': product.id,
+                        'unit': product.default_uom.id,
+                        'quantity': 1,
+                        'process': process2.id,
+                        } for _ in range(2)])
+            Production.cancel([cancelled])
+
+        self.assertEqual(Process.where_used([component]), {
+                'processes': sorted([process1.id, process2.id]),
+                'steps': sorted(
+                    [process1.steps[0].id, process2.steps[0].id]),
+                'productions': [production.id],
+                })
+        self.assertEqual(Process.where_used([]), {
+                'processes': [],
+                'steps': [],
+                'productions': [],
+                })
+
+    @with_transaction()
+    def test_step_consumption(self):
+        'Test consumption is aggregated per step, product and period'
+        pool = Pool()
+        Date = pool.get('ir.date')
+        Location = pool.get('stock.location')
+        Production = pool.get('production')
+        BOMInput = pool.get('production.bom.input')
+        BOMOutput = pool.get('production.bom.output')
+        StepConsumption = pool.get('production.step.consumption')
+
+        company = create_company()
+        product = create_product('Product', producible=True)
+        component = create_product('Component')
+        process = create_process('Process')
+        step, = process.steps
+        BOMInput.create([{
+                    'step': step.id,
+                    'product': component.id,
+                    'quantity': 2,
+                    'unit': component.default_uom.id,
+                    }])
+        BOMOutput.create([{
+                    'step': step.id,
+                    'product': product.id,
+                    'quantity': 1,
+                    'unit': product.default_uom.id,
+                    }])
+        warehouse, = Location.search([('code', '=', 'WH')])
+        today = Date.today()
+        with set_company(company):
+            productions = []
+            for _ in range(2):
+                production = Production(
+                    company=company,
+                    warehouse=warehouse,
+                    location=warehouse.production_location,
+                    product=product,
+                    unit=product.default_uom,
+                    quantity=3,
+                    planned_date=today,
+                    planned_start_date=today,
+                    process=process)
+                production.on_change_process()
+                productions.append(production)
+            Production.save(productions)
+
+            with Transaction().set_context(period='month'):
+                consumption, = StepConsumption.search([])
+        self.assertEqual(consumption.process, process)
+        self.assertEqual(consumption.step, step)
+        self.assertEqual(consumption.product, component)
+        self.assertEqual(consumption.date, today.replace(day=1))
+        self.assertEqual(consumption.planned_quantity, 12)
+        self.assertEqual(consumption.actual_quantity, 0)
+        self.assertEqual(consumption.wip_quantity, 0)
+
+    @with_transaction()
+    def test_generate_requests_partitions(self):
+        'Test the partitions of the supply generate the serial requests'
+        pool = Pool()
+        Date = pool.get('ir.date')
+        Location = pool.get('stock.location')
+        Move = pool.get('stock.move')
+        Production = pool.get('production')
+        ProductBom = pool.get('product.product-production.bom')
+        BOMInput = pool.get('production.bom.input')
+        BOMOutput = pool.get('production.bom.output')
+
+        company = create_company()
+        component = create_product('Component')
+        products = [create_product('Product %s' % i, producible=True)
+            for i in range(3)]
+        warehouse, = Location.search([('code', '=', 'WH')])
+        storage, = Location.search([('code', '=', 'STO')])
+        customer, = Location.search([('code', '=', 'CUS')])
+        for product in products:
+            process = create_process(product.rec_name)
+            step, = process.steps
+            BOMInput.create([{
+                        'step': step.id,
+                        'product': component.id,
+                        'quantity': 2,
+                        'unit': component.default_uom.id,
+                        }])
+            BOMOutput.create([{
+                        'step': step.id,
+                        'product': product.id,
+                        'quantity': 1,
+                        'unit': product.default_uom.id,
+                        }])
+            ProductBom.create([{
+                        'product': product.id,
+                        'process': process.id,
+                        }])
+
+        with set_company(company):
+            Move.create([{
+                        'product': product.id,
+                        'unit': product.default_uom.id,
+                        'quantity': 1,
+                        'from_location': storage.id,
+                        'to_location': customer.id,
+                        'planned_date': Date.today(),
+                        'company': company.id,
+                        'unit_price': Decimal(1),
+                        'currency': company.currency.id,
+                        } for product in products])
+
+            def supplied():
+                return sorted(
+                    (r.product.id, r.quantity, r.process.id,
+                        sorted((m.product.id, m.quantity) for m in r.inputs))
+                    for r in Production.search([('state', '=', 'request')]))
+
+            with Transaction().set_context(supply_partitions=1):
+                self.assertEqual(len(Production.generate_requests()), 3)
+            serial = supplied()
+            self.assertEqual(
+                [(p, i) for p, _, _, i in serial],
+                [(p.id, [(component.id, 2)]) for p in products])
+
+            with Transaction().set_context(supply_partitions=2):
+                self.assertEqual(Production.generate_requests(), [])
+            run_queue()
+            self.assertEqual(supplied(), serial)
+
+    def test_schedule(self):
+        'Test tasks are laid out on finite capacity resources by priority'
+        jobs = [
+            ((1,), 0, [('a1', 'A', 2), ('b1', 'B', 1)]),
+            ((0,), 0, [('a0', 'A', 3), ('b0', 'B', 1), ('c0', None, 1)]),
+            ((2,), 1, [('c2', None, 2)]),
+            ]
+        self.assertEqual(schedule(jobs), [
+                [('a1', 3, 5), ('b1', 5, 6)],
+                [('a0', 0, 3), ('b0', 3, 4), ('c0', 4, 5)],
+                [('c2', 1, 3)],
+                ])
+
+    @with_transaction()
+    def test_schedule_steps(self):
+        'Test production steps are planned without overlap on work centers'
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Location = pool.get('stock.location')
+        Production = pool.get('production')
+        Operation = pool.get('production.route.operation')
+        OperationType = pool.get('production.operation.type')
+        Category = pool.get('production.work_center.category')
+        WorkCenter = pool.get('production.work_center')
+
+        company = create_company()
+        hour, = Uom.search([('name', '=', 'Hour')])
+        product = create_product('Product', producible=True)
+        process = create_process('Process', steps=2)
+        operation_type, = OperationType.create([{'name': 'Operation'}])
+        category, = Category.create([{
+                    'name': 'Category',
+                    'uom': hour.id,
+                    'cost_price': 1,
+                    }])
+        work_center, = WorkCenter.create([{
+                    'name': 'Work Center',
+                    'category': category.id,
+                    'type': 'machine',
+                    }])
+        Operation.create([{
+                    'step': step.id,
+                    'operation_type': operation_type.id,
+                    'work_center_category': category.id,
+                    'work_center': work_center.id,
+                    'time': 2,
+                    'calculation': 'fixed',
+                    } for step in process.steps])
+        warehouse, = Location.search([('code', '=', 'WH')])
+        with set_company(company):
+            productions = Production.create([{
+                        'company': company.id,
+                        'warehouse': warehouse.id,
+                        'location': warehouse.production_location.id,
+                        'product': product.id,
+                        'unit': product.default_uom.id,
+                        'quantity': 1,
+                        'process': process.id,
+                        } for _ in range(2)])
+            Production.schedule_steps()
+
+        schedules = [s for p in productions for s in p.step_schedules]
+        self.assertEqual(len(schedules), 4)
+        for production in productions:
+            step1, step2 = production.step_schedules
+            self.assertEqual(
+                [step1.step, step2.step], list(process.steps))
+            self.assertLessEqual(
+                step1.planned_end_date, step2.planned_start_date)
+        schedules.sort(key=lambda s: s.planned_start_date)
+        for previous, next_ in zip(schedules, schedules[1:]):
+            self.assertLessEqual(
+                previous.planned_end_date, next_.planned_start_date)
+            self.assertEqual(
+                next_.planned_end_date - next_.planned_start_date,
+                datetime.timedelta(hours=2))
+
+        with set_company(company):
+            Production.schedule_steps(productions[:1])
+        productions = Production.browse(productions)
+        self.assertEqual(len(productions[0].step_schedules), 2)
+        self.assertEqual(len(productions[1].step_schedules), 2)
+
+    @with_transaction()
+    def test_apply_process(self):
+        'Test process is applied to many productions at once'
+        pool = Pool()
+        Location = pool.get('stock.location')
+        Move = pool.get('stock.move')
+        Production = pool.get('production')
+        BOMInput = pool.get('production.bom.input')
+        BOMOutput = pool.get('production.bom.output')
+
+        company = create_company()
+        product = create_product('Product', producible=True)
+        processes = []
+        for i in range(2):
+            component = create_product('Component %s' % i)
+            process = create_process('Process %s' % i)
+            step, = process.steps
+            BOMInput.create([{
+                        'step': step.id,
+                        'product': component.id,
+                        'quantity': 2,
+                        'unit': component.default_uom.id,
+                        }])
+            BOMOutput.create([{
+                        'step': step.id,
+                        'product': product.id,
+                        'quantity': 1,
+                        'unit': product.default_uom.id,
+                        }])
+            processes.append((process, step, component))
+        warehouse, = Location.search([('code', '=', 'WH')])
+        with set_company(company):
+            productions = Production.create([{
+                        'company': company.id,
+                        'warehouse': warehouse.id,
+                        'location': warehouse.production_location.id,
+                        'product': product.id,
+                        'unit': product.default_uom.id,
+                        'quantity': 3,
+                        } for _ in range(3)])
+
+            for process, step, component in processes:
+                Production.apply_process(productions, process)
+                productions = Production.browse(productions)
+                for production in productions:
+                    self.assertEqual(production.process, process)
+                    input_, = production.inputs
+                    self.assertEqual(input_.product, component)
+                    self.assertEqual(input_.quantity, 6)
+                    self.assertEqual(input_.production_step, step)
+                    output, = production.outputs
+                    self.assertEqual(output.quantity, 3)
+            self.assertEqual(Move.search([], count=True), 6)
+
+    @with_transaction(context={'production_process_instrumentation': True})
+    def test_instrumentation(self):
+        'Test instrumentation records calls, queries and time per method'
+        create_process('Process 1')
+        create_process('Process 2')
+
+        statistics = get_statistics()
+        calls, queries, elapsed = statistics['Process.create']
+        self.assertEqual(calls, 2)
+        self.assertGreater(queries, 0)
+        self.assertGreater(elapsed, 0)
+
+        with Transaction().set_context(
+                production_process_instrumentation=False):
+            create_process('Process 3')
+        self.assertEqual(get_statistics()['Process.create'][0], 2)
 
 
 del ModuleTestCase
@@ -0,0 +1,135 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from trytond import backend
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+__all__ = ['count_queries', 'query_plan', 'index_usable', 'run_queue',
+    'create_product', 'create_process']
+
+
+class _CountingCursor:
+    "Cursor wrapper that records the executed queries"
+
+    def __init__(self, cursor, queries):
+        self._cursor = cursor
+        self._queries = queries
+
+    def execute(self, query, *args, **kwargs):
+        self._queries.append(str(query))
+        return self._cursor.execute(query, *args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _CountingConnection:
+    "Connection wrapper that returns counting cursors"
+
+    def __init__(self, connection, queries):
+        self._connection = connection
+        self._queries = queries
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(
+            self._connection.cursor(*args, **kwargs), self._queries)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+@contextmanager
+def count_queries(table=None):
+    "Yield the list of queries executed, optionally filtered on table"
+    transaction = Transaction()
+    queries = []
+    connection = _CountingConnection(transaction.connection, queries)
+    with patch.object(transaction, 'connection', connection):
+        result = []
+        yield result
+    result.extend(q for q in queries if not table or '"%s"' % table in q)
+
+
+def query_plan(query):
+    '''
+    Return the lines of the query plan of query
+
+    Sequential scans are disabled on PostgreSQL so the plan shows an index
+    scan whenever an index can serve the query. So the plan does not tell
+    which scan would be chosen with the data of a real database.
+    '''
+    cursor = Transaction().connection.cursor()
+    sql, params = tuple(query)
+    if backend.name == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor]
+    cursor.execute('SET LOCAL enable_seqscan = off')
+    try:
+        cursor.execute('EXPLAIN ' + sql, params)
+        return [row[0] for row in cursor]
+    finally:
+        cursor.execute('SET LOCAL enable_seqscan = on')
+
+
+def index_usable(query):
+    '''
+    Return True if an index exists that the database can use to scan the
+    table of query
+
+    It does not assert that the index is chosen for real table sizes.
+    '''
+    for line in query_plan(query):
+        if backend.name == 'sqlite':
+            if 'USING' in line and 'INDEX' in line and 'AUTOMATIC' not in line:
+                return True
+        elif 'Index' in line:
+            return True
+    return False
+
+
+def run_queue():
+    "Run the tasks queued by the transaction as the worker would"
+    Queue = Pool().get('ir.queue')
+    tasks = Transaction().tasks
+    while tasks:
+        Queue(tasks.pop(0)).run()
+
+
+def create_product(name, producible=False):
+    pool = Pool()
+    Uom = pool.get('product.uom')
+    Template = pool.get('product.template')
+
+    unit, = Uom.search([('name', '=', 'Unit')])
+    template, = Template.create([{
+                'name': name,
+                'default_uom': unit.id,
+                'type': 'goods',
+                'producible': producible,
+                'products': [('create', [{}])],
+                }])
+    product, = template.products
+    return product
+
+
+def create_process(name, steps=1):
+    pool = Pool()
+    Process = pool.get('production.process')
+    Uom = pool.get('product.uom')
+
+    unit, = Uom.search([('name', '=', 'Unit')])
+    process, = Process.create([{
+                'name': name,
+                'uom': unit.id,
+                'steps': [('create', [{
+                                'name': 'Step %s' % i,
+                                'sequence': i,
+                                } for i in range(steps)])],
+                }])
+    return process